@@ -3,57 +3,100 @@
 #   OPERATOR
 #   STATION_CALLSIGN
 #   TX_PWR
+# and/or fill in DISTANCE and ANT_AZ from GRIDSQUARE and MY_GRIDSQUARE.
 # DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
 # based on ADIF.PY by OK4BX http://web.bxhome.org
 import sys, getopt, os
-import re
-import datetime
-import time
-import glob
-ADIF_REC_RE = re.compile(r'<(.*?):(\d+).*?>([^<\t\f\v]+)')
+import adif
+import adifgeo
+import adiftime
+import adiftrace
 
-def parse(fn):
-  raw = re.split('<eor>|<eoh>(?i)', open(fn).read() )
-  logbook =[]
-  for record in raw[1:-1]:
-    qso = {}
-    tags = ADIF_REC_RE.findall(record)
-    for tag in tags:
-      qso[tag[0].lower()] = tag[2][:int(tag[1])]
-    logbook.append(qso)    
-  return logbook
+HEADER = "Log: {}\nGenerated by SA6MWA add_fields.py\nhttps://github.com/sa6mwa/sa6mwa-logs\nbased on ADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n"
 
-def sortlogbook(data):
-  for i in range(len(data)):
-    # convert all entries into lower case and ensure qso_date and time_on exists
-    data[i] = {k.lower(): v for k, v in data[i].items()}
-    if 'qso_date' not in data[i]:
-      data[i]['qso_date'] = ""
-    if 'time_on' not in data[i]:
-      data[i]['time_on'] = ""
-  return sorted(data, key = lambda x: x['qso_date'] + x['time_on'])
+def changed(fh, buf, changes):
+  # the records of fh (buf already read from it) with changes applied
+  for tag, qso, start, end in adif.scan(fh, buf=buf):
+    if tag == "eor":
+      qso.update(changes)
+      yield qso
 
-def save(fn, data):
-  header = "Log: {}\nGenerated by SA6MWA add_fields.py\nhttps://github.com/sa6mwa/sa6mwa-logs\nbased on ADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n".format(fn)
-  if os.path.exists(fn):
-    split = re.split('<eoh>(?i)', open(fn).read())
-    if len(split) > 1:
-      header = split[0] + '<EOH>\n'
-  fh=open(fn,'w')
-  fh.write(header)
-  for qso in sortlogbook(data):
-    for key in sorted(qso):
-      value = qso[key]
-      fh.write('<%s:%i>%s ' % (key.upper(), len(value), value))
-    fh.write('<EOR>\n')
-  fh.close()
+def rewrite(job):
+  # runs in a worker process. job is (fn, changes, mygrid, sort, start, end),
+  # returns fn once changes are set in all its QSOs (or those from start to
+  # end). Unless mygrid is None missing distances and bearings are filled in
+  # as well, see adifgeo.locate(). The records are streamed from fn to a
+  # temporary file that replaces it, the header is taken from the first chunk
+  # read and the order is kept unless sort is set.
+  fn, changes, mygrid, sort, start, end = job
+  if start is not None or end is not None:
+    spans = adiftime.window(fn, start, end)
+    if mygrid is None:
+      patches = [(first, last, changes) for qso, first, last in spans]
+    else:
+      spans = list(spans)
+      located = adifgeo.locate([qso for qso, first, last in spans], mygrid or None)
+      patches = [(first, last, dict(changes, **fields)) for (qso, first, last), (q, fields) in zip(spans, located)]
+      patches = [p for p in patches if p[2]]
+    if patches:
+      adif.patchfile(fn, patches)
+    return fn
+  fh = adif.openlog(fn)
+  try:
+    buf = fh.read(adif.CHUNK_SIZE)
+    m = adif.ADIF_END_RE.search(buf)
+    if m is None:
+      # no record in the first chunk, a long header or an empty file
+      header = adif.header(fn) or HEADER.format(fn)
+    elif m.group(1).lower() == "eoh":
+      header = buf[:m.start()] + '<EOH>\n'
+    else:
+      header = HEADER.format(fn)
+    qsos = changed(fh, buf, changes)
+    if mygrid is not None:
+      qsos = adifgeo.fill(qsos, mygrid or None)
+    if sort:
+      qsos = adif.merge([qsos])
+    adif.save(fn, header, qsos)
+  finally:
+    fh.close()
+  return fn
+
+def rewritefiles(jobs, parallel):
+  # yields rewrite() results as the files are done, using a process pool if
+  # parallel > 1
+  if parallel > 1 and len(jobs) > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool(min(parallel, len(jobs)))
+    try:
+      for fn in pool.imap_unordered(rewrite, jobs):
+        yield fn
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    for job in jobs:
+      yield rewrite(job)
 
 def usage():
-  print "usage: %s [-c operator] [-s station_callsign] [-p tx_pwr] logfile1.adif [logfile2.adif...]" % sys.argv[0]
+  print """usage: {} [-c operator] [-s station_callsign] [-p tx_pwr] [-d] [-g grid] [-j jobs] [-S] [--from datetime] [--to datetime] logfile1.adif [logfile2.adif...]
+  With --from and/or --to (YYYYMMDD[HH[MM[SS]]]) only the QSOs in that range
+  are changed, in place, the rest of each file is left as it is.
+  -d, --distance   Fill in DISTANCE (km) and ANT_AZ (degrees) where missing,
+                   computed from GRIDSQUARE and MY_GRIDSQUARE
+  -g, --grid grid  Like -d, with grid for QSOs without MY_GRIDSQUARE
+  -j, --jobs jobs  Number of files to rewrite in parallel (default is 1)
+  -S, --sort       Also sort the QSOs of each file by date and time, otherwise
+                   they are kept in the order they are in
+  --profile        When done, print time per stage, counts and peak memory as
+                   JSON on stderr (or ADIF_TRACE=1), files rewritten by worker
+                   processes are not counted
+  --profile-dump file
+                   Also write cProfile stats to file (or ADIF_TRACE_DUMP=file)""".format(sys.argv[0])
 
 def main():
   try:
-    opts, adifs = getopt.getopt(sys.argv[1:], "hc:s:p:", ["help","operator=","station=","power="])
+    opts, adifs = getopt.getopt(sys.argv[1:], "hc:s:p:dg:j:S", ["help","operator=","station=","power=","distance","grid=","jobs=","sort","from=","to=","profile","profile-dump="])
   except getopt.GetoptError as err:
     print str(err)
     usage()
@@ -61,6 +104,11 @@ def main():
   operator = None
   station = None
   txpwr = None
+  mygrid = None
+  start = None
+  end = None
+  jobs = 1
+  sort = False
   for o, a in opts:
     if o in ("-h", "--help"):
       usage()
@@ -71,20 +119,39 @@ def main():
       station = a.upper()
     elif o in ("-p", "--power"):
       txpwr = a
+    elif o in ("-d", "--distance"):
+      mygrid = mygrid or ""
+    elif o in ("-g", "--grid"):
+      assert adifgeo.latlon(a) is not None, "-g must be a Maidenhead locator like JO67"
+      mygrid = a.upper()
+    elif o in ("-j", "--jobs"):
+      jobs = int(a)
+    elif o in ("-S", "--sort"):
+      sort = True
+    elif o == "--profile":
+      adiftrace.enable()
+    elif o == "--profile-dump":
+      adiftrace.enable(a)
+    elif o == "--from":
+      start = adiftime.bound(a)
+    elif o == "--to":
+      end = adiftime.bound(a, upper=True)
     else:
       assert False, "unhandled option"
-  if (not operator and not station and not txpwr) or len(adifs) < 1:
+  if (not operator and not station and not txpwr and mygrid is None) or len(adifs) < 1:
     usage()
     sys.exit(2)
-  for f in adifs:
-    logbook = parse(f)
-    for qso in logbook:
-      if operator:
-        qso["operator"] = operator
-      if station:
-        qso["station_callsign"] = station
-      if txpwr:
-        qso["tx_pwr"] = txpwr
-    save(f, logbook)
+  if [f for f in adifs if adif.isadx(f)]:
+    print "error: ADX logs cannot be changed, convert them with lexa.py -e log.adif log.adx first"
+    sys.exit(2)
+  changes = dict()
+  if operator:
+    changes["operator"] = operator
+  if station:
+    changes["station_callsign"] = station
+  if txpwr:
+    changes["tx_pwr"] = txpwr
+  for f in adiftrace.timed("rewrite", rewritefiles([(f, changes, mygrid, sort, start, end) for f in adifs], jobs)):
+    pass
 if __name__ == '__main__':
   main()
@@ -0,0 +1,772 @@
+# adif.py - shared ADIF routines for the sa6mwa-logs scripts
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+# based on ADIF.PY by OK4BX http://web.bxhome.org
+import os
+import re
+import shutil
+import bisect
+import calendar
+import heapq
+import marshal
+import adiftrace
+
+# <name>, <name:length> or <name:length:type> followed by the value which is
+# exactly length bytes. The trailing [^<]* captures the value in the common
+# case, values containing "<" are sliced out using the declared length.
+ADIF_TOKEN_RE = re.compile(r'<([^:<>\s]+)(?::(\d+)(?::[^<>]*)?)?>([^<]*)')
+ADIF_FIELD_RE = re.compile(r'<([^:<>\s]+):(\d+)[^<>]*>([^<]*)')
+# spelled out rather than re.I, which would keep the regex engine from
+# skipping ahead to the next "<"
+ADIF_END_RE = re.compile(r'<([eE][oO][rRhH])>')
+# splits a record into text, tag, value, tag, value... see scan()
+ADIF_TAG_RE = re.compile(r'<([^<>]*)>')
+ADIF_LENGTH_RE = re.compile(r'([^:<>\s]+):(\d+)')
+CHUNK_SIZE = 1 << 16
+# records merge() keeps in memory before spilling sorted runs to disk
+SORT_BUDGET = 250000
+# records serialized into one buffer before it is written
+WRITE_BATCH = 4096
+# Logs named *.gz, *.xz or *.zst are read and written compressed (xz needs the
+# lzma module, on Python 2 from backports.lzma, zst the zstandard module).
+# ADIF_COMPRESSLEVEL sets the level new data is compressed with, otherwise
+# each format uses its own default. The modules are only imported once a
+# compressed log is opened, see _module().
+COMPRESSED = (".gz", ".xz", ".zst")
+# Logs named *.db or *.sqlite are SQLite logbooks, see adifdb.py
+DATABASES = (".db", ".sqlite")
+COMPRESSLEVEL = int(os.environ["ADIF_COMPRESSLEVEL"]) if os.environ.get("ADIF_COMPRESSLEVEL") else None
+
+# Common fields get a slot of their own in QSO, other fields go into a dict
+# that is only created for records that have them. Values of the fields in
+# SHARED repeat a lot and are interned.
+FIELDS = (
+  "call", "qso_date", "time_on", "qso_date_off", "time_off", "band", "mode",
+  "submode", "freq", "rst_sent", "rst_rcvd", "qsl_rcvd", "qsl_sent",
+  "operator", "station_callsign", "tx_pwr", "gridsquare", "my_gridsquare",
+  "name", "comment", "dxcc", "distance" )
+SHARED = frozenset([
+  "qso_date", "qso_date_off", "band", "mode", "submode", "rst_sent",
+  "rst_rcvd", "qsl_rcvd", "qsl_sent", "operator", "station_callsign",
+  "tx_pwr", "my_gridsquare", "dxcc" ])
+_SLOTTED = frozenset(FIELDS)
+
+# ADIF band enumeration, lower and upper edge in MHz
+BANDS = [
+  (0.1357, 0.1378, "2190m"), (0.472, 0.479, "630m"), (0.501, 0.504, "560m"),
+  (1.8, 2.0, "160m"), (3.5, 4.0, "80m"), (5.06, 5.45, "60m"), (7.0, 7.3, "40m"),
+  (10.1, 10.15, "30m"), (14.0, 14.35, "20m"), (18.068, 18.168, "17m"),
+  (21.0, 21.45, "15m"), (24.89, 24.99, "12m"), (28.0, 29.7, "10m"),
+  (40.0, 45.0, "8m"), (50.0, 54.0, "6m"), (54.000001, 69.9, "5m"),
+  (70.0, 71.0, "4m"), (144.0, 148.0, "2m"), (222.0, 225.0, "1.25m"),
+  (420.0, 450.0, "70cm"), (902.0, 928.0, "33cm"), (1240.0, 1300.0, "23cm"),
+  (2300.0, 2450.0, "13cm"), (3300.0, 3500.0, "9cm"), (5650.0, 5925.0, "6cm"),
+  (10000.0, 10500.0, "3cm"), (24000.0, 24250.0, "1.25cm"),
+  (47000.0, 47200.0, "6mm"), (75500.0, 81000.0, "4mm"),
+  (119980.0, 123000.0, "2.5mm"), (134000.0, 149000.0, "2mm"),
+  (241000.0, 250000.0, "1mm"), (300000.0, 7500000.0, "submm") ]
+_EDGES = [low for low, high, band in BANDS]
+BAND_NAMES = frozenset(band for low, high, band in BANDS)
+
+class QSO(object):
+  # Compact record with the same mapping interface as the dicts from reader(),
+  # a fraction of the size of a dict. The timestamp is computed once and kept
+  # until qso_date or time_on changes. Other fields than FIELDS are kept as
+  # two tuples, their names (shared by the records with the same fields, see
+  # _plan()) and their values.
+  __slots__ = FIELDS + ("_keys", "_extra", "_ts")
+
+  def __init__(self, fields=()):
+    if hasattr(fields, "items"):
+      fields = fields.items()
+    fields = list(fields)
+    if fields:
+      names, values = zip(*fields)
+      _fill(self, names, values)
+
+  def __getitem__(self, k):
+    if k in _SLOTTED:
+      v = getattr(self, k, None)
+    else:
+      try:
+        v = self._extra[self._keys.index(k)]
+      except (AttributeError, ValueError):
+        v = None
+    if v is None:
+      raise KeyError(k)
+    return v
+
+  def __setitem__(self, k, v):
+    if k in SHARED:
+      v = intern(v)
+    if k in _SLOTTED:
+      setattr(self, k, v)
+      if k == "qso_date" or k == "time_on":
+        self._ts = None
+      return
+    keys = getattr(self, "_keys", ())
+    if k in keys:
+      i = keys.index(k)
+      self._extra = self._extra[:i] + (v,) + self._extra[i + 1:]
+    else:
+      self._keys = keys + (intern(k),)
+      self._extra = getattr(self, "_extra", ()) + (v,)
+
+  def __delitem__(self, k):
+    if k in _SLOTTED and getattr(self, k, None) is not None:
+      delattr(self, k)
+    elif k not in _SLOTTED and k in getattr(self, "_keys", ()):
+      i = self._keys.index(k)
+      self._keys = self._keys[:i] + self._keys[i + 1:]
+      self._extra = self._extra[:i] + self._extra[i + 1:]
+    else:
+      raise KeyError(k)
+
+  def __contains__(self, k):
+    try:
+      self[k]
+    except KeyError:
+      return False
+    return True
+
+  def __iter__(self):
+    for k in FIELDS:
+      if getattr(self, k, None) is not None:
+        yield k
+    for k in getattr(self, "_keys", ()):
+      yield k
+
+  def __len__(self):
+    return sum(1 for k in self)
+
+  def keys(self):
+    return list(self)
+
+  def items(self):
+    return [(k, self[k]) for k in self]
+
+  def values(self):
+    return [self[k] for k in self]
+
+  iterkeys = __iter__
+  def iteritems(self):
+    return iter(self.items())
+
+  def get(self, k, default=None):
+    try:
+      return self[k]
+    except KeyError:
+      return default
+
+  def pop(self, k, *default):
+    try:
+      v = self[k]
+    except KeyError:
+      if default:
+        return default[0]
+      raise
+    del self[k]
+    return v
+
+  def copy(self):
+    return QSO(self.items())
+
+  def timestamp(self):
+    if getattr(self, "_ts", None) is None:
+      self._ts = _timestamp(self)
+    return self._ts
+
+  def __eq__(self, other):
+    return hasattr(other, "items") and dict(self.items()) == dict(other.items())
+
+  def __ne__(self, other):
+    return not self == other
+
+  __hash__ = None
+
+  def __reduce__(self):
+    return (QSO, (self.items(),))
+
+  def __repr__(self):
+    return "QSO(%r)" % dict(self.items())
+
+# names of the fields of a record -> how _fill() puts its values into a QSO
+_plans = dict()
+PLANS = 1024
+
+def _plan(names):
+  # (shared slots, their indexes in values, other slots, indexes, other field
+  # names, indexes) for a record with the fields names. A field given twice
+  # gets its last value, as in a dict.
+  last = dict((k, i) for i, k in enumerate(names))
+  shared, slotted, extra = list(), list(), list()
+  for i, k in enumerate(names):
+    if last[k] == i:
+      (shared if k in SHARED else slotted if k in _SLOTTED else extra).append((k, i))
+  plan = list()
+  for fields in (shared, slotted, extra):
+    plan.append(tuple(intern(k) for k, i in fields))
+    plan.append(tuple(i for k, i in fields))
+  plan = tuple(plan)
+  if len(_plans) >= PLANS:
+    _plans.clear()
+  _plans[names] = plan
+  return plan
+
+def _fill(qso, names, values):
+  # sets the fields names of the new qso to values in a few calls rather than
+  # a __setitem__() per field
+  plan = _plans.get(names) or _plan(names)
+  shared, sharedat, slotted, slottedat, keys, keysat = plan
+  get = values.__getitem__
+  if shared:
+    map(setattr, [qso] * len(shared), shared, map(intern, map(get, sharedat)))
+  if slotted:
+    map(setattr, [qso] * len(slotted), slotted, map(get, slottedat))
+  if keys:
+    qso._keys = keys
+    qso._extra = tuple(map(get, keysat))
+
+def _qso(names, values):
+  # the record with the fields names and values as a QSO, see scan()
+  qso = object.__new__(QSO)
+  _fill(qso, names, values)
+  return qso
+
+def _dict(names, values):
+  return dict(zip(names, values))
+
+def _exact(buf, pos, names):
+  # length driven parse of the record starting at pos, returns (tag, qso, end)
+  # or None if buf ends before the record does
+  qso = {}
+  while True:
+    m = ADIF_TOKEN_RE.search(buf, pos)
+    if m is None:
+      return None
+    name, length = m.group(1, 2)
+    pos = m.start(3)
+    if length is None:
+      tag = name.lower()
+      if tag in ("eor", "eoh"):
+        return tag, qso, pos
+      continue
+    end = pos + int(length)
+    if end > len(buf):
+      return None
+    lname = names.get(name)
+    if lname is None:
+      lname = names[name] = intern(name.lower())
+    qso[lname] = buf[pos:end]
+    pos = end
+
+class _Tags(dict):
+  # the text of a tag ("CALL:6" or "call:6:s") -> (name, length), the name
+  # lower case and interned, None for a tag without a length. A log only has
+  # a few hundred different tags, each is parsed once.
+  def __missing__(self, tag):
+    m = ADIF_LENGTH_RE.match(tag)
+    field = self[tag] = (intern(m.group(1).lower()), int(m.group(2))) if m else None
+    return field
+
+def scan(fh, chunksize=CHUNK_SIZE, offset=0, buf=None, build=_dict):
+  # Incremental record reader, yields (tag, qso, start, end) for every record
+  # terminated by <eor> or <eoh> (tag is "eor" or "eoh"), qso is a dict with
+  # lower case field names and start/end is the byte span of the record in the
+  # file, offset is the position fh has been read or seeked to. buf is what
+  # has already been read from fh at offset, if anything. Only one chunk plus
+  # the record being read is held in memory, a trailing record without <eor>
+  # is dropped. The records are made by build(names, values), _qso makes
+  # them QSOs rather than dicts.
+  # A record is split on its tags and all of its fields are looked up,
+  # stripped and checked against their lengths at once (map() and zip()
+  # rather than a loop per field). Only if a value is not what is left up to
+  # the next tag less trailing whitespace (it contains "<" or ends with
+  # whitespace) is the record read field by field.
+  names = {}
+  lookup = _Tags().__getitem__
+  split = ADIF_TAG_RE.split
+  rstrip = str.rstrip
+  if buf is None:
+    buf = fh.read(chunksize)
+  if adiftrace.ENABLED:
+    adiftrace.add("bytes_read", len(buf))
+  eof = not buf
+  base = offset # file offset of buf[0]
+  pos = 0
+  while True:
+    more = True
+    for m in ADIF_END_RE.finditer(buf, pos):
+      # text, tag, value, tag, value...
+      parts = split(buf[pos:m.start()])
+      fields = map(lookup, parts[1::2])
+      if None not in fields:
+        values = map(rstrip, parts[2::2])
+        fnames, lengths = zip(*fields) or ((), ())
+        if tuple(map(len, values)) == lengths:
+          yield m.group(1).lower(), build(fnames, values), base + pos, base + m.end()
+          pos = m.end()
+          continue
+      # a value contains "<" (maybe even "<eor>"), go by the declared lengths
+      r = _exact(buf, pos, names)
+      if r is not None:
+        tag, qso, end = r
+        if build is not _dict:
+          qso = build(tuple(qso.keys()), qso.values())
+        yield tag, qso, base + pos, base + end
+        pos = end
+        more = False
+      break
+    if more:
+      if eof:
+        return
+      chunk = fh.read(chunksize)
+      if adiftrace.ENABLED:
+        adiftrace.add("bytes_read", len(chunk))
+      eof = not chunk
+      base += pos
+      buf = buf[pos:] + chunk
+      pos = 0
+
+def reader(fh, build=_dict):
+  # yields one dict (or what build makes, see scan()) per <eor> terminated
+  # record, the header is skipped
+  for tag, qso, start, end in scan(fh, build=build):
+    if tag == "eor":
+      yield qso
+
+def compression(fn):
+  # the compression extension of fn (".gz" etc) or None
+  ext = os.path.splitext(fn)[1].lower()
+  return ext if ext in COMPRESSED else None
+
+def isdb(fn):
+  return fn.lower().endswith(DATABASES)
+
+def isadx(fn):
+  # True for an ADX log (*.adx, *.adx.gz etc), see adifadx.py
+  ext = compression(fn)
+  return (fn[:-len(ext)] if ext else fn).lower().endswith(".adx")
+
+_modules = dict()
+
+def _module(ext):
+  # the module handling ext, imported on first use
+  module = _modules.get(ext)
+  if module is not None:
+    return module
+  try:
+    if ext == ".gz":
+      import gzip as module
+    elif ext == ".xz":
+      try:
+        import lzma as module
+      except ImportError:
+        from backports import lzma as module
+    else:
+      import zstandard as module
+  except ImportError:
+    raise IOError("reading or writing %s files needs the %s module" % (ext, "zstandard" if ext == ".zst" else "lzma (backports.lzma)"))
+  _modules[ext] = module
+  return module
+
+def openlog(fn):
+  # fn opened for reading, decompressed if its name says it is compressed.
+  # Compressed files are decompressed as they are read, seeking backwards may
+  # mean decompressing from the start again (or not work for .zst).
+  ext = compression(fn)
+  if ext == ".gz":
+    return _module(ext).open(fn, 'rb')
+  if ext == ".xz":
+    return _module(ext).LZMAFile(fn, 'rb')
+  if ext == ".zst":
+    return _module(ext).ZstdDecompressor().stream_reader(open(fn, 'rb'), read_across_frames=True)
+  return open(fn, 'rb')
+
+def compressor(raw, fn, level=None):
+  # a file object writing to raw, compressed if the name fn says so. Done
+  # writing, call finish().
+  ext = compression(fn)
+  if level is None:
+    level = COMPRESSLEVEL
+  if ext == ".gz":
+    return _module(ext).GzipFile(os.path.basename(fn)[:-len(ext)], 'wb', 9 if level is None else level, raw)
+  if ext == ".xz":
+    return _module(ext).LZMAFile(raw, 'wb', preset=level)
+  if ext == ".zst":
+    return _module(ext).ZstdCompressor(level=3 if level is None else level).stream_writer(raw)
+  return raw
+
+def finish(fh, raw, fn):
+  # ends the compressed stream fh from compressor() and syncs raw to disk, raw
+  # is left open
+  ext = compression(fn)
+  if ext == ".zst":
+    # closing the zstandard writer would close raw as well
+    fh.flush(_module(ext).FLUSH_FRAME)
+  elif ext is not None:
+    fh.close()
+  raw.flush()
+  os.fsync(raw.fileno())
+
+def iterparse(fn, build=_dict):
+  if isadx(fn):
+    import adifadx
+    for qso in adifadx.iterparse(fn):
+      yield qso if build is _dict else build(tuple(qso.keys()), qso.values())
+    return
+  fh = openlog(fn)
+  try:
+    for qso in reader(fh, build):
+      yield qso
+  finally:
+    fh.close()
+
+def parse(fn):
+  # the records of fn as QSOs, made right from the tokenizer
+  return list(iterparse(fn, _qso))
+
+def iterspans(fn):
+  # yields (qso, start, end) for every record of fn, start/end is the byte span
+  # of the record in the file (the decompressed file for a compressed log)
+  fh = openlog(fn)
+  try:
+    for tag, qso, start, end in scan(fh):
+      if tag == "eor":
+        yield qso, start, end
+  finally:
+    fh.close()
+
+def patch(raw, changes):
+  # Returns raw, the bytes of one record up to and including <eor>, with the
+  # fields in changes set. Fields in the record keep their place, tag case and
+  # type, missing fields are added before <eor> in the style of the record.
+  # Everything else is left byte for byte as it is.
+  todo = dict(changes)
+  out = list()
+  pos = 0 # raw is copied to out up to here
+  search = 0
+  last = None # end of the last value
+  upper = True
+  while True:
+    m = ADIF_TOKEN_RE.search(raw, search)
+    if m is None:
+      raise ValueError("record has no <eor>: %r" % raw)
+    name, length = m.group(1, 2)
+    vstart = m.start(3)
+    if length is None:
+      if name.lower() != "eor":
+        search = vstart
+        continue
+      sep = raw[last:m.start()] if last is not None else " "
+      out.append(raw[pos:m.start()])
+      for k in sorted(todo):
+        out.append('<%s:%i>%s%s' % (k.upper() if upper else k, len(todo[k]), todo[k], sep))
+      out.append(raw[m.start():])
+      return "".join(out)
+    vend = vstart + int(length)
+    k = name.lower()
+    if k in todo:
+      v = todo.pop(k)
+      out.append(raw[pos:m.start()])
+      out.append('<%s:%i%s%s' % (name, len(v), raw[m.end(2):vstart], v))
+      pos = vend
+    upper = name != k
+    last = search = vend
+
+def _copy(src, dst, n):
+  while n > 0:
+    chunk = src.read(min(n, CHUNK_SIZE))
+    if not chunk:
+      break
+    dst.write(chunk)
+    n -= len(chunk)
+
+def patchfile(fn, patches):
+  # Applies patch() to the records of fn at the given (start, end, changes)
+  # spans, see iterspans(). If no record changes length the new bytes are
+  # written in place, otherwise fn is spliced into a temporary file that
+  # replaces fn (always for a compressed log, which is recompressed). Either
+  # way the rest of fn is left untouched.
+  fh = openlog(fn)
+  edits = list()
+  for start, end, changes in sorted(patches):
+    fh.seek(start)
+    edits.append((start, end, patch(fh.read(end - start), changes)))
+  fh.close()
+  if compression(fn) is None and all(len(raw) == end - start for start, end, raw in edits):
+    fh = open(fn, 'r+b')
+    for start, end, raw in edits:
+      fh.seek(start)
+      fh.write(raw)
+    fh.flush()
+    os.fsync(fh.fileno())
+    fh.close()
+    return
+  out, tmp = mkstemp(fn)
+  src = openlog(fn)
+  try:
+    dst = compressor(out, fn)
+    pos = 0
+    for start, end, raw in edits:
+      _copy(src, dst, start - pos)
+      dst.write(raw)
+      src.seek(end)
+      pos = end
+    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    finish(dst, out, fn)
+  except:
+    out.close()
+    os.unlink(tmp)
+    raise
+  finally:
+    src.close()
+  out.close()
+  replacefile(fn, tmp)
+
+def mkstemp(fn):
+  # (file object, name) of a new temporary file next to fn
+  import tempfile
+  fd, tmp = tempfile.mkstemp(prefix=os.path.basename(fn) + '.', dir=os.path.dirname(os.path.abspath(fn)))
+  return os.fdopen(fd, 'wb'), tmp
+
+def replacefile(fn, tmp):
+  # moves tmp over fn in one step, with the mode of fn or, for a new fn, the
+  # mode a new file would get (tempfile.mkstemp() only gives the owner access)
+  if os.path.exists(fn):
+    shutil.copymode(fn, tmp)
+  else:
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp, 0666 & ~umask)
+  os.rename(tmp, fn)
+
+def record(qso):
+  # qso as an ADIF record the way the scripts write them, fields in name order
+  return "".join(['<%s:%i>%s ' % (k.upper(), len(qso[k]), qso[k]) for k in sorted(qso)]) + '<EOR>\n'
+
+def _write(fh, data, serialize):
+  # serializes data in batches of WRITE_BATCH records, one write per batch
+  batch = list()
+  for qso in data:
+    batch.append(serialize(qso))
+    if len(batch) >= WRITE_BATCH:
+      _writelines(fh, batch)
+      del batch[:]
+  _writelines(fh, batch)
+
+def _writelines(fh, lines):
+  if adiftrace.ENABLED:
+    adiftrace.add("bytes_written", sum(len(line) for line in lines))
+  fh.writelines(lines)
+
+def save(fn, head, data, serialize=record, level=None, tail=""):
+  # Writes head, the records of data (serialized by record() or the given
+  # function) and tail to a temporary file which replaces fn once it has been
+  # synced to disk, so fn is either the old or the new log however the write
+  # ends. A compressed log is compressed at level, see compressor().
+  raw, tmp = mkstemp(fn)
+  try:
+    fh = compressor(raw, fn, level)
+    _writelines(fh, [head])
+    _write(fh, data, serialize)
+    if tail:
+      _writelines(fh, [tail])
+    finish(fh, raw, fn)
+  except:
+    raw.close()
+    os.unlink(tmp)
+    raise
+  raw.close()
+  replacefile(fn, tmp)
+
+def append(fn, data, head, serialize=record, level=None):
+  # Adds the records of data to the end of fn, head is only written if fn is
+  # new or empty. What is in fn already is not touched, a compressed log gets
+  # another compressed member (gzip) or stream (xz) or frame (zstd) which reads
+  # back as if the log had been compressed in one go.
+  raw = open(fn, 'ab')
+  try:
+    raw.seek(0, os.SEEK_END)
+    empty = raw.tell() == 0
+    fh = compressor(raw, fn, level)
+    if empty:
+      _writelines(fh, [head])
+    _write(fh, data, serialize)
+    finish(fh, raw, fn)
+  finally:
+    raw.close()
+
+def header(fn):
+  # returns the header of fn up to and including <EOH> or None if fn has no
+  # header, only reads as far as the first <eoh> or <eor>
+  fh = openlog(fn)
+  try:
+    for tag, qso, start, end in scan(fh):
+      if tag == "eoh":
+        fh.close()
+        fh = openlog(fn)
+        return fh.read(end)[:-len("<eoh>")] + '<EOH>\n'
+      return None
+  finally:
+    fh.close()
+
+def sortkey(qso):
+  return qso.get("qso_date", "") + qso.get("time_on", "")
+
+def _spill(run):
+  # writes the (key, stream, seq, qso) items of a sorted run to a temporary
+  # file and returns a generator reading them back
+  import tempfile
+  fh = tempfile.TemporaryFile()
+  for key, i, seq, qso in run:
+    if type(qso) is not dict:
+      qso = dict(qso.items())
+    marshal.dump((key, i, seq, qso), fh)
+  fh.seek(0)
+  return _unspill(fh)
+
+def _unspill(fh):
+  try:
+    while True:
+      try:
+        yield marshal.load(fh)
+      except EOFError:
+        return
+  finally:
+    fh.close()
+
+def _keyed(stream, i):
+  seq = 0
+  for qso in stream:
+    yield sortkey(qso), i, seq, qso
+    seq += 1
+
+def merge(streams, budget=SORT_BUDGET, ordered=None):
+  # Yields the records of one or more streams (e.g. iterparse() of every log
+  # file) ordered by qso_date and time_on, records with the same time keep
+  # their order. Each stream is read once as a run which is only sorted if it
+  # is not already in order, the runs are then k-way merged. If more than
+  # budget records (None for no limit) have been read the runs held so far are
+  # merged into a run on disk, so memory stays bounded for any log size.
+  # ordered is a list with a flag per stream, True for a stream known to be in
+  # order (e.g. a log whose adiftime index says so). Such a stream is merged
+  # as it is read rather than read as a run first, so if all streams are
+  # known to be in order the first records come out right away and a reader
+  # that stops early never reads the rest.
+  # Records are only the same objects as in the streams if nothing was spilled,
+  # spilled records come back as dicts.
+  runs = list()
+  held = list()
+  count = 0
+  lazy = None # the last stream known to be in order
+  for i, stream in enumerate(streams):
+    if ordered and ordered[i]:
+      runs.append(_keyed(stream, i))
+      lazy = stream
+      continue
+    run = list()
+    last = ""
+    inorder = True
+    seq = 0
+    for qso in stream:
+      key = sortkey(qso)
+      if key < last:
+        inorder = False
+      last = key
+      run.append((key, i, seq, qso))
+      seq += 1
+      count += 1
+      if budget and count >= budget:
+        if not inorder:
+          run.sort()
+        held.append(run)
+        runs.append(_spill(heapq.merge(*held)))
+        run, last, inorder = list(), "", True
+        held = list()
+        count = 0
+    if not inorder:
+      run.sort()
+    held.append(run)
+  runs.extend(held)
+  if len(runs) == 1 and lazy is not None:
+    # nothing to merge it with
+    for qso in lazy:
+      yield qso
+    return
+  for key, i, seq, qso in heapq.merge(*runs):
+    yield qso
+
+def fingerprint(qso):
+  # canonical hash of the complete record, equal for records with the same
+  # fields and values regardless of field order
+  import hashlib
+  return hashlib.sha1(''.join(['<%s:%i>%s' % (key, len(qso[key]), qso[key]) for key in sorted(qso)])).hexdigest()
+
+def matchkey(qso):
+  # the fields compareQSO() matches on, with time_on padded to seconds so that
+  # 1045 and 104500 are the same minute
+  for k in [ "qso_date", "time_on", "call", "mode", "band" ]:
+    assert k in qso, "required key {} is not in qso: {}".format(k, qso)
+  return (qso["call"], qso["mode"], qso["band"], qso["qso_date"] + qso["time_on"].ljust(6, "0"))
+
+def timestamp(qso):
+  # qso_date and time_on as seconds since the epoch (UTC)
+  if isinstance(qso, QSO):
+    return qso.timestamp()
+  return _timestamp(qso)
+
+def _timestamp(qso):
+  d, t = qso["qso_date"], qso["time_on"].ljust(6, "0")
+  return calendar.timegm((int(d[0:4]), int(d[4:6]), int(d[6:8]), int(t[0:2]), int(t[2:4]), int(t[4:6])))
+
+def band(mhz):
+  # the band of mhz (a float) or None if it is outside all bands
+  i = bisect.bisect_right(_EDGES, mhz) - 1
+  if i >= 0 and mhz <= BANDS[i][1]:
+    return BANDS[i][2]
+  return None
+
+def megahertz(freq):
+  # FREQ as MHz (a float) or None if it is missing or not a number. FREQ is
+  # in MHz, but some loggers (termlog) write kHz: a value outside all bands
+  # whose thousandth is in one is taken as kHz.
+  try:
+    mhz = float(freq)
+  except (TypeError, ValueError):
+    return None
+  if band(mhz) is None and band(mhz / 1000) is not None:
+    return mhz / 1000
+  return mhz
+
+def sweep(logbook, qsos, tolerance):
+  # Time tolerant duplicate detection. Returns a list of booleans, True if
+  # qsos[i] is not within tolerance seconds of a QSO with the same call, band
+  # and mode in logbook or of an earlier QSO in qsos. Both sides are grouped
+  # per (call, band, mode) and sorted by time, then swept in one pass so this
+  # is O(n log n) rather than comparing every pair.
+  old = {}
+  for qso in logbook:
+    call, mode, band, ts = matchkey(qso)
+    old.setdefault((call, band, mode), []).append(timestamp(qso))
+  new = {}
+  for i, qso in enumerate(qsos):
+    call, mode, band, ts = matchkey(qso)
+    new.setdefault((call, band, mode), []).append((timestamp(qso), i))
+  isnew = [False] * len(qsos)
+  for key, items in new.items():
+    items.sort()
+    times = sorted(old.get(key, ()))
+    j = 0
+    last = None # latest QSO at or before t, from logbook or accepted from qsos
+    for t, i in items:
+      while j < len(times) and times[j] <= t:
+        if last is None or times[j] > last:
+          last = times[j]
+        j += 1
+      if last is not None and t - last <= tolerance:
+        continue
+      if j < len(times) and times[j] - t <= tolerance:
+        continue
+      isnew[i] = True
+      last = t
+  return isnew
@@ -0,0 +1,100 @@
+# adifadx.py - ADX (the XML form of ADIF) reader and writer
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# A log named *.adx (or *.adx.gz etc) is ADX:
+#
+#   <?xml version="1.0" encoding="UTF-8"?>
+#   <ADX>
+#     <HEADER>...</HEADER>
+#     <RECORDS>
+#       <RECORD><CALL>SM6XYZ</CALL><QSO_DATE>20210212</QSO_DATE>...
+#         <APP PROGRAMID="WSJT-X" FIELDNAME="SNR" TYPE="S">-12</APP>
+#       </RECORD>
+#     </RECORDS>
+#   </ADX>
+#
+# iterparse() yields each RECORD as the same dict adif.scan() gives for an
+# ADI record (lower case field names, APP fields as app_programid_fieldname,
+# values as UTF-8 strings) and clears the parsed elements as it goes, so a log
+# of any size is read in constant memory. record() writes a QSO as a RECORD
+# and save() streams QSOs into a new ADX log like adif.save(). ADX logs are
+# read by all scripts (adif.iterparse() and adiftime.iterlog() hand them to
+# this module) but always written in full, never appended to or patched.
+try:
+  import xml.etree.cElementTree as ElementTree
+except ImportError:
+  import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape, quoteattr
+import adif
+
+HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n<ADX>\n<HEADER>\n<PROGRAMID>SA6MWA sa6mwa-logs</PROGRAMID>\n</HEADER>\n<RECORDS>\n'
+TAIL = '</RECORDS>\n</ADX>\n'
+
+def _text(s):
+  if s is None:
+    return ""
+  if isinstance(s, unicode):
+    return s.encode("utf-8")
+  return s
+
+def _name(elem, names):
+  tag = elem.tag
+  if tag == "APP":
+    k = "app_%s_%s" % (elem.get("PROGRAMID", ""), elem.get("FIELDNAME", ""))
+  elif tag == "USERDEF":
+    k = elem.get("FIELDNAME", "")
+  else:
+    k = tag
+  name = names.get(k)
+  if name is None:
+    name = names[k] = intern(k.lower())
+  return name
+
+def iterparse(fn):
+  # yields a dict per RECORD of fn, the header is skipped
+  names = dict()
+  fh = adif.openlog(fn)
+  try:
+    parents = list() # the elements being read, RECORDS is the last one
+    for event, elem in ElementTree.iterparse(fh, events=("start", "end")):
+      if event == "start":
+        parents.append(elem)
+        continue
+      parents.pop()
+      if elem.tag != "RECORD":
+        continue
+      qso = dict()
+      for field in elem:
+        qso[_name(field, names)] = _text(field.text)
+      # drop the record and detach it from RECORDS, which would otherwise
+      # keep every record read so far
+      elem.clear()
+      if parents:
+        del parents[-1][:]
+      yield qso
+  finally:
+    fh.close()
+
+def _utf8(v):
+  try:
+    v.decode("utf-8")
+    return v
+  except UnicodeDecodeError:
+    # ADI logs are often Latin-1
+    return v.decode("latin-1").encode("utf-8")
+
+def record(qso):
+  # qso as an ADX RECORD, fields in name order
+  fields = list()
+  for k in sorted(qso):
+    v = escape(_utf8(qso[k]))
+    if k.startswith("app_") and k.count("_") >= 2:
+      programid, fieldname = k[4:].split("_", 1)
+      fields.append('<APP PROGRAMID=%s FIELDNAME=%s TYPE="S">%s</APP>' % (quoteattr(programid.upper()), quoteattr(fieldname.upper()), v))
+    else:
+      fields.append('<%s>%s</%s>' % (k.upper(), v, k.upper()))
+  return "<RECORD>" + "".join(fields) + "</RECORD>\n"
+
+def save(fn, data, level=None):
+  # writes the QSOs of data to fn as ADX, see adif.save()
+  adif.save(fn, HEAD, data, record, level, TAIL)
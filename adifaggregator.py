@@ -1,42 +1,301 @@
 #!/usr/bin/env python
-import re
-import datetime
-import time
+import sys, getopt, os
+import multiprocessing
+import hashlib
+import json
+import adif
+import adiftime
+import adiftrace
 import glob
-ADIF_REC_RE = re.compile(r'<(.*?):(\d+).*?>([^<\t\f\v]+)')
-def parse(fn):
-    raw = re.split('<eor>|<eoh>(?i)', open(fn).read() )
-    logbook =[]
-    for record in raw[1:-1]:
-        qso = {}
-        tags = ADIF_REC_RE.findall(record)
-        for tag in tags:
-                qso[tag[0].lower()] = tag[2][:int(tag[1])]
-        logbook.append(qso)    
-    return logbook
+MANIFEST_VERSION = 2
+HEADER = 'Generated by SA6MWA adifaggregator.py based on\nADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n'
 def save(fn, data):
-    fh=open(fn,'w')
-    fh.write('Generated by SA6MWA adifaggregator.py based on\nADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n')
-    for qso in data:
-        for key in sorted(qso):
-            value = qso[key]
-            fh.write('<%s:%i>%s ' % (key.upper(), len(value), value))
-        fh.write('<EOR>\n')
+    adif.save(fn, HEADER, data)
+def append(fn, data):
+    adif.append(fn, data, HEADER)
+
+def manifestname(output):
+  return output + '.manifest'
+
+def fingerprintsname(output):
+  return output + '.fingerprints'
+
+def _stat(fn):
+  st = os.stat(fn)
+  return { "size": st.st_size, "mtime": st.st_mtime }
+
+def _dump(fn, data):
+  fh = open(fn + '.tmp', 'w')
+  json.dump(data, fh)
+  fh.close()
+  os.rename(fn + '.tmp', fn)
+
+def load_manifest(output, tolerance):
+  # returns the manifest of output if it is still valid for output, i.e. output
+  # has not been touched since the manifest was written, otherwise None. The
+  # manifest only holds size, mtime, sha1 and end of each file, enough to tell
+  # that nothing has changed, the fingerprints are kept apart and only loaded
+  # by load_fingerprints() when something has.
+  fn = manifestname(output)
+  if not os.path.exists(fn) or not os.path.exists(output):
+    return None
+  try:
+    manifest = json.load(open(fn))
+  except ValueError:
+    return None
+  if manifest.get("version") != MANIFEST_VERSION or manifest.get("tolerance") != tolerance:
+    return None
+  if manifest["output"] != _stat(output):
+    return None
+  return manifest
+
+def load_fingerprints(output, manifest):
+  # adds the fingerprints of each file to the entries of manifest, returns
+  # False if they are missing or do not belong to manifest
+  fn = fingerprintsname(output)
+  if not os.path.exists(fn) or manifest.get("fingerprints") != _stat(fn):
+    return False
+  try:
+    fps = json.load(open(fn))
+  except ValueError:
+    return False
+  for f, entry in manifest["files"].items():
+    if f not in fps:
+      return False
+    entry["fingerprints"] = str(fps[f])
+  return True
+
+def save_manifest(output, tolerance, files, fingerprints=None):
+  # writes the manifest of files and their fingerprints, fingerprints is the
+  # size and mtime of the fingerprints saved before if they are still the same
+  if fingerprints is None:
+    fn = fingerprintsname(output)
+    _dump(fn, dict((f, entry["fingerprints"]) for f, entry in files.items()))
+    fingerprints = _stat(fn)
+  manifest = {
+    "version": MANIFEST_VERSION,
+    "tolerance": tolerance,
+    "output": _stat(output),
+    "fingerprints": fingerprints,
+    "files": dict((f, dict((k, v) for k, v in entry.items() if k != "fingerprints")) for f, entry in files.items()) }
+  _dump(manifestname(output), manifest)
+
+def unchanged(fn, old):
+  # True if fn is as recorded in its manifest entry old, by size and mtime or,
+  # if only the mtime differs, by sha1. The entry gets the new mtime.
+  st = os.stat(fn)
+  if not old or old["size"] != st.st_size:
+    return False
+  if old["mtime"] != st.st_mtime:
+    if filehash(fn, st.st_size) != old["sha1"]:
+      return False
+    old["mtime"] = st.st_mtime
+  return True
+
+def fingerprints(entry):
+  # the manifest keeps each file's fingerprints as one string of hex digests
+  fps = entry["fingerprints"]
+  return [fps[i:i+40] for i in range(0, len(fps), 40)]
+
+def filehash(fn, size):
+  # sha1 of the first size bytes of fn
+  h = hashlib.sha1()
+  fh = open(fn, 'rb')
+  while size > 0:
+    chunk = fh.read(min(size, adif.CHUNK_SIZE))
+    if not chunk:
+      break
+    h.update(chunk)
+    size -= len(chunk)
+  fh.close()
+  return h.hexdigest()
+
+def scanfile(job):
+  # runs in a worker process. job is (fn, manifest entry or None), if the
+  # entry shows fn has only been appended to since, just the new tail is
+  # parsed (ADX files are always parsed in full). Returns (fn, new manifest
+  # entry, [(fingerprint, qso),...])
+  fn, old = job
+  st = os.stat(fn)
+  offset = 0
+  fps = ""
+  records = []
+  if adif.isadx(fn):
+    records = [(adif.fingerprint(qso), qso) for qso in adif.iterparse(fn)]
+    end = st.st_size
+  else:
+    if old and st.st_size > old["size"] and filehash(fn, old["size"]) == old["sha1"]:
+      offset = old["end"]
+      fps = old["fingerprints"]
+    end = offset
+    fh = adif.openlog(fn)
+    fh.seek(offset)
+    for tag, qso, start, end in adif.scan(fh, offset=offset):
+      if tag == "eor":
+        records.append((adif.fingerprint(qso), qso))
     fh.close()
-#def conv_datetime(adi_date, adi_time):
-#    return datetime.datetime.strptime(adi_date+adi_time.ljust(6,"0"), "%Y%m%d%H%M%S")
+  entry = {
+    "size": st.st_size,
+    "mtime": st.st_mtime,
+    "sha1": filehash(fn, st.st_size),
+    "end": end,
+    "fingerprints": fps + "".join(fp for fp, qso in records) }
+  return fn, entry, records
+
+def scanfiles(jobs, parallel):
+  # yields scanfile() results in job order, using a process pool if parallel > 1
+  if parallel > 1 and len(jobs) > 1:
+    pool = multiprocessing.Pool(min(parallel, len(jobs)))
+    try:
+      for result in pool.imap(scanfile, jobs):
+        yield result
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    for job in jobs:
+      yield scanfile(job)
+
+def nearby(output, qsos, tolerance):
+  # the QSOs of output at most tolerance seconds from any of qsos, the only
+  # ones a time tolerant sweep of qsos can match. They are read through the
+  # time index of output (all.adif.tix), one window per run of qsos close in
+  # time if output is in time order, otherwise in one pass over output that
+  # only keeps the QSOs between the first and the last window.
+  spans = list()
+  for k in sorted(k for k in map(adiftime.key, qsos) if k is not None):
+    start, end = adiftime.shift(k, -tolerance), adiftime.shift(k, tolerance)
+    if spans and start <= spans[-1][1]:
+      spans[-1][1] = end
+    else:
+      spans.append([start, end])
+  if len(spans) > 1 and (len(spans) * adiftime.STEP > os.path.getsize(output) or not adiftime.ordered(output)):
+    spans = [[spans[0][0], spans[-1][1]]]
+  for start, end in spans:
+    for qso in adiftime.iterwindow(output, start, end):
+      yield qso
+
+def usage():
+  print """usage: {} [--force] [-j jobs] [-T seconds]
+  Aggregate all *.adi, *.adif and *.adx (ADX) files in the current directory
+  into all.adif, also compressed ones (*.adif.gz, *.adif.xz, *.adif.zst)
+      --force              Rebuild all.adif from scratch, ignore the manifest
+  -j, --jobs jobs          Number of files to parse in parallel (default is
+                           the number of CPUs)
+  -T, --tolerance seconds  Treat QSOs with the same call, band and mode at
+                           most this many seconds apart as duplicates
+      --profile            When done, print time per stage, counts and peak
+                           memory as JSON on stderr (or ADIF_TRACE=1), files
+                           parsed by worker processes are not counted
+      --profile-dump file  Also write cProfile stats to file (or
+                           ADIF_TRACE_DUMP=file)
+  What went into all.adif is recorded in all.adif.manifest (and the
+  fingerprints of its QSOs in all.adif.fingerprints), on the next run
+  unchanged files are skipped and files that have only grown are read from
+  where the last run stopped.
+""".format(sys.argv[0]),
 def main():
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "hj:T:", ["help","force","jobs=","tolerance=","profile","profile-dump="])
+  except getopt.GetoptError as err:
+    print str(err)
+    usage()
+    sys.exit(2)
+  force = False
+  tolerance = None
+  jobs = multiprocessing.cpu_count()
+  for o, a in opts:
+    if o in ("-h", "--help"):
+      usage()
+      sys.exit()
+    elif o == "--force":
+      force = True
+    elif o in ("-j", "--jobs"):
+      jobs = int(a)
+    elif o in ("-T", "--tolerance"):
+      tolerance = int(a)
+    elif o == "--profile":
+      adiftrace.enable()
+    elif o == "--profile-dump":
+      adiftrace.enable(a)
+    else:
+      assert False, "unhandled option"
   output = 'all.adif'
-  adifs = [i for sublist in [glob.glob(ext) for ext in ['*.adi', '*.adif']] for i in sublist]
+  patterns = [ext + z for ext in ['*.adi', '*.adif', '*.adx'] for z in ('',) + adif.COMPRESSED]
+  adifs = [i for sublist in [glob.glob(ext) for ext in patterns] for i in sublist if i != output]
+  manifest = None if force else load_manifest(output, tolerance)
+
+  if manifest:
+    oldfiles = manifest["files"]
+    files = dict()
+    changed = list()
+    touched = False
+    for f in adifs:
+      old = oldfiles.get(f)
+      mtime = old and old["mtime"]
+      if unchanged(f, old):
+        files[f] = old
+        touched = touched or old["mtime"] != mtime
+      else:
+        changed.append((f, old))
+    if not changed and len(files) == len(oldfiles):
+      if touched:
+        save_manifest(output, tolerance, files, manifest["fingerprints"])
+      print "%s is up to date." % output
+      return
+    if not load_fingerprints(output, manifest):
+      manifest = None
+  if manifest:
+    before = set()
+    for entry in oldfiles.values():
+      before.update(fingerprints(entry))
+    delta = list()
+    seen = set()
+    for f, entry, records in adiftrace.timed("scan", scanfiles(changed, jobs)):
+      files[f] = entry
+      if adiftrace.ENABLED:
+        adiftrace.add("dedup_comparisons", len(records))
+      for fp, qso in records:
+        if fp not in before and fp not in seen:
+          seen.add(fp)
+          delta.append(qso)
+    after = set()
+    for entry in files.values():
+      after.update(fingerprints(entry))
+    if before - after:
+      # QSOs were edited or removed, all.adif has to be rebuilt
+      manifest = None
+    else:
+      if delta and tolerance is not None:
+        delta = [qso for qso, isnew in zip(delta, adif.sweep(nearby(output, delta, tolerance), delta, tolerance)) if isnew]
+      if delta:
+        with adiftrace.stage("write"):
+          append(output, delta)
+        print "Added %i QSOs to %s" % (len(delta), output)
+      else:
+        print "%s is up to date." % output
+      save_manifest(output, tolerance, files)
+      return
+
   logbook = list()
-  for f in adifs:
-    flogbook = parse(f)
-    for qso in flogbook:
-      if qso not in logbook:
-        logbook.append(qso)
+  files = dict()
+  seen = set()
+  # scanfiles() keeps the file order so the first copy of a QSO is the one kept
+  for f, entry, records in adiftrace.timed("scan", scanfiles([(f, None) for f in adifs], jobs)):
+    files[f] = entry
+    if adiftrace.ENABLED:
+      adiftrace.add("dedup_comparisons", len(records))
+    for fp, qso in records:
+      if fp not in seen:
+        seen.add(fp)
+        logbook.append(adif.QSO(qso))
+  if tolerance is not None:
+    logbook = [qso for qso, isnew in zip(logbook, adif.sweep([], logbook, tolerance)) if isnew]
 
   if len(logbook) > 0:
-    save(output, logbook)
+    with adiftrace.stage("write"):
+      save(output, logbook)
+    save_manifest(output, tolerance, files)
     print "Saved " + output
   else:
     print "No QSOs or adif files found in current directory."
@@ -0,0 +1,204 @@
+# adifcache.py - columnar sidecar cache (logfile.adif.idx) for fast listing
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# The sidecar holds every field of every record column by column so that a
+# listing only has to read the columns it prints. Layout (little endian):
+#
+#   magic "ADIFIDX2"
+#   source size (Q), source mtime (d), records (I), columns (I), order (Q)
+#   per column: name length (H), name, type (c), width (B), present (I),
+#               offset (Q)
+#   column data, at offset:
+#     presence bitmap, (records + 7) / 8 bytes, omitted if present == records
+#     type F: records * width bytes, values padded with NUL
+#     type H: (records + 1) * I offsets into the heap that follows, heap bytes
+#   at order, unless it is 0 (the records are in time order already):
+#     records * I record numbers in qso_date/time_on order
+#
+# The short, fixed width fields (qso_date, time_on, band, mode) are stored as
+# type F unless a value does not fit, all others as type H. The sidecar is
+# rebuilt whenever the size or mtime of the source file changes. records()
+# reads the values of a block of records at a time straight from the mapped
+# sidecar, so a listing that stops early only reads the records it lists.
+# Heap offsets are 32 bits, a log larger than MAXSIZE gets no sidecar and is
+# parsed instead.
+import os
+import mmap
+import struct
+import array
+import itertools
+import adif
+
+MAGIC = "ADIFIDX2"
+HEADER = struct.Struct("<QdIIQ")
+COLUMN = struct.Struct("<cBIQ")
+FIXED = { "qso_date": 8, "time_on": 6, "band": 6, "mode": 8 }
+# records read from the sidecar at a time
+BLOCK = 4096
+# the largest log a sidecar is written for, the heap offsets are 'I'
+MAXSIZE = 0xFFFFFFFF
+
+def cachename(fn):
+  return fn + '.idx'
+
+def _bitmap(values):
+  bits = bytearray((len(values) + 7) // 8)
+  for i, value in enumerate(values):
+    if value is not None:
+      bits[i >> 3] |= 1 << (i & 7)
+  return str(bits)
+
+def _order(columns, n):
+  # the record numbers in time order (adif.sortkey()) as an array, None if
+  # the records are in order already
+  none = [None] * n
+  keys = [(d or "") + (t or "") for d, t in itertools.izip(columns.get("qso_date", none), columns.get("time_on", none))]
+  if all(a <= b for a, b in itertools.izip(keys, itertools.islice(keys, 1, None))):
+    return None
+  return array.array('I', sorted(xrange(n), key=keys.__getitem__))
+
+def build(fn):
+  # parses fn and writes its sidecar, returns the sidecar file name
+  st = os.stat(fn)
+  if st.st_size > MAXSIZE:
+    raise IOError("%s is too large for a sidecar (%i bytes)" % (fn, st.st_size))
+  # a list of values per field, None where a record does not have it
+  columns = dict()
+  n = 0
+  for qso in adif.iterparse(fn):
+    for k, v in qso.iteritems():
+      col = columns.get(k)
+      if col is None:
+        col = columns[k] = list()
+      if len(col) < n:
+        col.extend([None] * (n - len(col)))
+      col.append(v)
+    n += 1
+  for col in columns.itervalues():
+    col.extend([None] * (n - len(col)))
+  order = _order(columns, n)
+  names = sorted(columns)
+  blobs = list()
+  for name in names:
+    values = columns.pop(name)
+    present = n - values.count(None)
+    blob = _bitmap(values) if present < n else ""
+    width = FIXED.get(name, 0)
+    if width and all(len(v) <= width and "\0" not in v for v in values if v is not None):
+      blob += "".join([(v or "").ljust(width, "\0") for v in values])
+      blobs.append((name, "F", width, present, blob))
+    else:
+      offsets = array.array('I', [0])
+      heap = list()
+      size = 0
+      for v in values:
+        if v:
+          heap.append(v)
+          size += len(v)
+        offsets.append(size)
+      blob += offsets.tostring() + "".join(heap)
+      blobs.append((name, "H", 0, present, blob))
+  directory = len(MAGIC) + HEADER.size + sum(2 + len(name) + COLUMN.size for name in names)
+  tmp = cachename(fn) + '.tmp'
+  fh = open(tmp, 'wb')
+  fh.write(MAGIC)
+  fh.write(HEADER.pack(st.st_size, st.st_mtime, n, len(names), directory + sum(len(blob) for name, kind, width, present, blob in blobs) if order else 0))
+  offset = directory
+  for name, kind, width, present, blob in blobs:
+    fh.write(struct.pack("<H", len(name)) + name)
+    fh.write(COLUMN.pack(kind, width, present, offset))
+    offset += len(blob)
+  for name, kind, width, present, blob in blobs:
+    fh.write(blob)
+  if order:
+    fh.write(order.tostring())
+  fh.close()
+  os.rename(tmp, cachename(fn))
+  return cachename(fn)
+
+def _open(fn):
+  # returns (mmap, records, order, {name: (type, width, present, offset)}) of
+  # a fresh sidecar for fn, building it first if it is missing or stale
+  idx = cachename(fn)
+  st = os.stat(fn)
+  for attempt in (1, 2):
+    if os.path.exists(idx) and os.path.getsize(idx) >= len(MAGIC) + HEADER.size:
+      fh = open(idx, 'rb')
+      mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+      fh.close()
+      size, mtime, n, ncolumns, order = HEADER.unpack_from(mm, len(MAGIC))
+      if mm[:len(MAGIC)] == MAGIC and size == st.st_size and mtime == st.st_mtime:
+        columns = dict()
+        pos = len(MAGIC) + HEADER.size
+        for i in xrange(ncolumns):
+          namelen, = struct.unpack_from("<H", mm, pos)
+          name = mm[pos + 2:pos + 2 + namelen]
+          columns[name] = COLUMN.unpack_from(mm, pos + 2 + namelen)
+          pos += 2 + namelen + COLUMN.size
+        return mm, n, order, columns
+      mm.close()
+    build(fn)
+  raise IOError("unable to build %s" % idx)
+
+def _reader(mm, n, kind, width, present, offset):
+  # returns a function taking a sequence of record numbers and returning the
+  # values of the column for them, None where the field is missing. Only
+  # those values are read from mm.
+  bits = None
+  if present < n:
+    bits = bytearray(mm[offset:offset + (n + 7) // 8])
+    offset += len(bits)
+  if kind == "F":
+    def read(idx):
+      return [mm[offset + i * width:offset + (i + 1) * width].rstrip("\0") for i in idx]
+  else:
+    offsets = array.array('I')
+    offsets.fromstring(mm[offset:offset + (n + 1) * 4])
+    heap = offset + (n + 1) * 4
+    def read(idx):
+      return [mm[heap + offsets[i]:heap + offsets[i + 1]] for i in idx]
+  if bits is None:
+    return read
+  def readmissing(idx):
+    # a missing value is stored as an empty one, the bitmap tells them apart
+    return [v if v or bits[i >> 3] & (1 << (i & 7)) else None for v, i in itertools.izip(read(idx), idx)]
+  return readmissing
+
+def _parsed(fn, ordered):
+  # the records of fn parsed, for when the sidecar cannot answer
+  if ordered:
+    return adif.merge([adif.iterparse(fn)])
+  return adif.iterparse(fn)
+
+def records(fn, names, ordered=False):
+  # yields a dict per record of fn holding only the given fields, in the
+  # order of the file or, if ordered is True, in qso_date/time_on order. If
+  # fn is too large for a sidecar or none of the fields are in it the records
+  # are parsed from fn (with all their fields) instead.
+  if os.path.getsize(fn) > MAXSIZE:
+    for qso in _parsed(fn, ordered):
+      yield qso
+    return
+  mm, n, order, directory = _open(fn)
+  try:
+    names = [name for name in set(names) if name in directory]
+    if not names:
+      for qso in _parsed(fn, ordered):
+        yield qso
+      return
+    readers = [_reader(mm, n, *directory[name]) for name in names]
+    missing = [name for name in names if directory[name][2] < n]
+    if ordered and order:
+      order = array.array('I', mm[order:order + n * 4])
+    else:
+      order = None
+    for start in xrange(0, n, BLOCK):
+      idx = order[start:start + BLOCK] if order else xrange(start, min(start + BLOCK, n))
+      for row in itertools.izip(*[read(idx) for read in readers]):
+        qso = dict(itertools.izip(names, row))
+        for name in missing:
+          if qso[name] is None:
+            del qso[name]
+        yield qso
+  finally:
+    mm.close()
@@ -0,0 +1,157 @@
+# adifdb.py - optional SQLite store (logfile.db) for large logs
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# A log named *.db or *.sqlite is kept in a SQLite database instead of an ADIF
+# file. Each QSO is a row with the fields duplicates are matched on (call,
+# mode, band and qso_date/time_on as adiftime.key(), see adif.matchkey()) in
+# columns of their own and all of its fields as a JSON object. ADIF values are
+# bytes in whatever character set the logging program used, they are stored
+# as Latin-1 (one code point per byte) so a QSO comes back byte for byte as it
+# went in. The unique index on the match columns makes the
+# database drop duplicates on insert, the time, call and band indexes answer
+# --from/--to and --where queries without reading the whole log. lexa.py -e
+# exports a database (or part of it) as an ADIF file again.
+import os
+import re
+import errno
+import json
+import sqlite3
+import adif
+import adiftime
+import adifquery
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS qso (
+  id INTEGER PRIMARY KEY,
+  call TEXT NOT NULL,
+  mode TEXT NOT NULL,
+  band TEXT NOT NULL,
+  ts TEXT NOT NULL,
+  fields TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS qso_match ON qso (call, mode, band, ts);
+CREATE INDEX IF NOT EXISTS qso_ts ON qso (ts);
+CREATE INDEX IF NOT EXISTS qso_call ON qso (call COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS qso_band ON qso (band COLLATE NOCASE);
+"""
+# PRAGMA user_version of the current layout, 0 is a logbook from before the
+# fields were JSON
+FORMAT_VERSION = 1
+# fields whose = terms are looked up in an index, all terms are still checked
+# by adifquery.predicate() afterwards
+INDEXED = ("call", "band")
+
+def connect(fn):
+  db = sqlite3.connect(fn)
+  db.text_factory = str
+  db.executescript(SCHEMA)
+  version, = db.execute("PRAGMA user_version").fetchone()
+  if version < FORMAT_VERSION:
+    _upgrade(db, version)
+  return db
+
+def _upgrade(db, version):
+  # converts the fields of a logbook written by an older version
+  with db:
+    if version == 0:
+      import marshal
+      last = 0
+      while True:
+        rows = db.execute("SELECT id, fields FROM qso WHERE id > ? ORDER BY id LIMIT 10000", (last,)).fetchall()
+        if not rows:
+          break
+        db.executemany("UPDATE qso SET fields = ? WHERE id = ?", [(_dumps(marshal.loads(str(fields))), rowid) for rowid, fields in rows])
+        last = rows[-1][0]
+    db.execute("PRAGMA user_version = %d" % FORMAT_VERSION)
+
+def _dumps(qso):
+  return json.dumps(dict(qso.items()), encoding="latin-1", separators=(",", ":"))
+
+def _loads(fields):
+  return dict((k.encode("latin-1"), v.encode("latin-1")) for k, v in json.loads(fields).iteritems())
+
+def _row(qso):
+  call, mode, band, ts = adif.matchkey(qso)
+  return (call, mode, band, ts, _dumps(qso))
+
+def insert(db, qsos, tolerance=None):
+  # inserts qsos in a transaction the caller commits, or rolls back for a dry
+  # run. Yields (qso, isnew) like adif.sweep(), isnew is False if qso is a
+  # duplicate of a QSO already in db or inserted before it. With a tolerance
+  # QSOs with the same call, mode and band at most that many seconds apart are
+  # duplicates.
+  cur = db.cursor()
+  for qso in qsos:
+    row = _row(qso)
+    if tolerance:
+      cur.execute("SELECT 1 FROM qso WHERE call = ? AND mode = ? AND band = ? AND ts BETWEEN ? AND ? LIMIT 1",
+        row[:3] + (adiftime.shift(row[3], -tolerance), adiftime.shift(row[3], tolerance)))
+      if cur.fetchone():
+        yield qso, False
+        continue
+    cur.execute("INSERT OR IGNORE INTO qso (call, mode, band, ts, fields) VALUES (?, ?, ?, ?, ?)", row)
+    yield qso, cur.rowcount == 1
+
+def _where(start, end, query):
+  # SQL condition and parameters for the date range and the indexed terms of
+  # query
+  clauses = list()
+  params = list()
+  if start is not None:
+    clauses.append("ts >= ?")
+    params.append(start)
+  if end is not None:
+    clauses.append("ts <= ?")
+    params.append(end)
+  for field, op, value in adifquery.terms(query or []):
+    if op == "=" and field in INDEXED:
+      values = value.split("|")
+      clauses.append("%s COLLATE NOCASE IN (%s)" % (field, ", ".join("?" * len(values))))
+      params.extend(values)
+    elif field == "qso_date" and op in ("<", "<=", ">", ">=") and re.match(r'^\d{8}$', value):
+      clauses.append("ts %s ?" % op)
+      params.append(adiftime.bound(value, upper=op in ("<=", ">")))
+  return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+def window(fn, start=None, end=None, query=None):
+  # yields (qso, id) in time order for the QSOs of fn with start <= key <= end
+  # (bounds from adiftime.bound(), None for no limit), narrowed down by the
+  # terms of query that an index can answer
+  if not os.path.exists(fn):
+    raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), fn)
+  db = connect(fn)
+  try:
+    where, params = _where(start, end, query)
+    for rowid, fields in db.execute("SELECT id, fields FROM qso" + where + " ORDER BY ts, id", params):
+      yield adif.QSO(_loads(fields)), rowid
+  finally:
+    db.close()
+
+def iterwindow(fn, start=None, end=None, query=None):
+  # the QSOs of window() without their ids
+  for qso, rowid in window(fn, start, end, query):
+    yield qso
+
+def describe(qso):
+  return " ".join(qso.get(k, "?") for k in ("call", "qso_date", "time_on", "mode", "band"))
+
+def update(fn, edits):
+  # edits is [(id, {field: value}),...], changes the QSOs in one transaction.
+  # Raises ValueError and changes nothing if an edit would make a QSO a
+  # duplicate of another one (same call, mode, band, date and time).
+  db = connect(fn)
+  try:
+    with db:
+      for rowid, changes in edits:
+        fields, = db.execute("SELECT fields FROM qso WHERE id = ?", (rowid,)).fetchone()
+        qso = _loads(fields)
+        before = describe(qso)
+        qso.update(changes)
+        row = _row(qso)
+        try:
+          db.execute("UPDATE qso SET call = ?, mode = ?, band = ?, ts = ?, fields = ? WHERE id = ?", row + (rowid,))
+        except sqlite3.IntegrityError:
+          other, = db.execute("SELECT fields FROM qso WHERE call = ? AND mode = ? AND band = ? AND ts = ?", row[:4]).fetchone()
+          raise ValueError("%s: the edit would make QSO %s a duplicate of QSO %s, nothing was saved" % (fn, before, describe(_loads(other))))
+  finally:
+    db.close()
@@ -0,0 +1,245 @@
+# adifexport.py - write QSOs to several files and formats in one pass
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# A sink writes QSOs in one format: ADIF, SMFF (ADIF with stx_string as
+# MY_CITY and srx_string as QTH, see termlog2smff-activator.py), ADX,
+# Cabrillo, CSV or JSON Lines. export() reads the QSOs once and hands each one to every
+# sink. A sink keeps at most adif.WRITE_BATCH formatted records in memory and
+# writes to a temporary file that only replaces the output once all QSOs have
+# been written, like adif.save().
+#
+# An output is given as format:filename, or just filename when the format
+# follows from the extension (.adi, .adif, .adx, .cbr, .csv, .jsonl), e.g.
+#
+#   all.adif  smff:smff-3509.adi  contest.cbr  log.csv  log.jsonl.gz
+#
+# Outputs named *.gz, *.xz or *.zst are compressed, see adif.compressor().
+import os
+import csv
+import json
+import adif
+import adiftrace
+
+class Sink(object):
+  # base class, subclasses implement format(qso) returning the text of one
+  # QSO and may set head and tail
+  head = ""
+  tail = ""
+
+  def __init__(self, fn, **options):
+    self.fn = fn
+    self.fh = None
+    self.buffer = list()
+
+  def add(self, qso):
+    self.buffer.append(self.format(qso))
+    if len(self.buffer) >= adif.WRITE_BATCH:
+      self.flush()
+
+  def flush(self):
+    if self.fh is None:
+      # fh compresses into raw if the output is named *.gz etc
+      self.raw, self.tmp = adif.mkstemp(self.fn)
+      self.fh = adif.compressor(self.raw, self.fn)
+      self.fh.write(self.head)
+    if adiftrace.ENABLED:
+      adiftrace.add("bytes_written", sum(len(line) for line in self.buffer))
+    self.fh.writelines(self.buffer)
+    del self.buffer[:]
+
+  def close(self):
+    self.flush()
+    self.fh.write(self.tail)
+    adif.finish(self.fh, self.raw, self.fn)
+    self.raw.close()
+    self.fh = None
+    adif.replacefile(self.fn, self.tmp)
+
+  def abort(self):
+    # drops what has been written, the output is left as it was
+    if self.fh is not None:
+      self.raw.close()
+      os.unlink(self.tmp)
+      self.fh = None
+    del self.buffer[:]
+
+class AdifSink(Sink):
+  # head is the header of a new file, {} is replaced with its name
+  def __init__(self, fn, head="Log: {}\nGenerated by SA6MWA adifexport.py\nhttps://github.com/sa6mwa/sa6mwa-logs\n<EOH>\n", **options):
+    Sink.__init__(self, fn)
+    self.head = head.format(fn)
+    # an existing log keeps its header
+    if os.path.exists(fn):
+      self.head = adif.header(fn) or self.head
+
+  def format(self, qso):
+    return adif.record(qso)
+
+class SmffSink(Sink):
+  REQUIRED = [
+    "call", "qso_date", "time_on",
+    "rst_sent", "rst_rcvd", "mode",
+    "band", "stx_string" ]
+  KEYS = [
+    "operator",
+    "call",
+    "qso_date",
+    "time_on",
+    "rst_sent",
+    "rst_rcvd",
+    "mode",
+    "band",
+    "my_city",
+    "qth",
+    "notes" ]
+
+  def __init__(self, fn, operator=None, **options):
+    Sink.__init__(self, fn)
+    self.operator = operator
+    self.head = 'Log: %s\nGenerated by SA6MWA termlog2smff-activator.py\nhttps://github.com/sa6mwa\nbased on ADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n\n' % fn
+
+  def format(self, qso):
+    for k in self.REQUIRED:
+      if k not in qso:
+        raise ValueError("%s key is not in the following qso:\n%s" % (k, qso))
+    if "operator" not in qso and not self.operator:
+      raise ValueError("operator key is missing in qso:\n%s" % qso)
+    smff = dict(qso.items())
+    smff["my_city"] = smff.pop("stx_string", "")
+    smff["qth"] = smff.pop("srx_string", "")
+    smff["operator"] = smff.get("operator", self.operator).upper()
+    fields = list()
+    for key in self.KEYS:
+      value = smff.get(key, "")
+      fields.append("<%s:%i>%s\n" % (key.upper(), len(value), value))
+    fields.append("<EOR>\n\n")
+    return "".join(fields)
+
+class AdxSink(Sink):
+  def __init__(self, fn, **options):
+    import adifadx
+    Sink.__init__(self, fn)
+    self.head = adifadx.HEAD
+    self.tail = adifadx.TAIL
+    self.format = adifadx.record
+
+class CabrilloSink(Sink):
+  # Cabrillo 3.0, the header is taken from the first QSO (station_callsign or
+  # operator) unless callsign is given
+  MODES = { "CW": "CW", "SSB": "PH", "USB": "PH", "LSB": "PH", "AM": "PH", "FM": "FM", "RTTY": "RY" }
+  BANDS = {
+    "160m": "1800", "80m": "3500", "60m": "5300", "40m": "7000", "30m": "10100",
+    "20m": "14000", "17m": "18068", "15m": "21000", "12m": "24890", "10m": "28000",
+    "6m": "50", "4m": "70", "2m": "144", "70cm": "432" }
+
+  def __init__(self, fn, callsign=None, contest=None, **options):
+    Sink.__init__(self, fn)
+    self.callsign = callsign
+    self.contest = contest
+    self.started = False
+    self.header(callsign or "")
+    self.tail = "END-OF-LOG:\n"
+
+  def header(self, callsign):
+    self.head = "START-OF-LOG: 3.0\nCREATED-BY: SA6MWA adifexport.py\nCALLSIGN: %s\n" % callsign.upper()
+    if self.contest:
+      self.head += "CONTEST: %s\n" % self.contest
+
+  def add(self, qso):
+    if not self.started and not self.callsign:
+      self.header(qso.get("station_callsign") or qso.get("operator") or "")
+    self.started = True
+    Sink.add(self, qso)
+
+  def frequency(self, qso):
+    # the frequency in kHz (see adif.megahertz() for FREQ logged in kHz). If
+    # FREQ is missing, not a number or in no band, the band edge from BANDS
+    # is used instead.
+    band = qso.get("band", "")
+    mhz = adif.megahertz(qso.get("freq"))
+    if mhz is None or (adif.band(mhz) is None and band.lower() in self.BANDS):
+      return self.BANDS.get(band.lower(), band)
+    return "%d" % round(mhz * 1000)
+
+  def format(self, qso):
+    freq = self.frequency(qso)
+    mode = self.MODES.get(qso.get("mode", "").upper(), "DG")
+    d = qso.get("qso_date", "")
+    date = "%s-%s-%s" % (d[0:4], d[4:6], d[6:8])
+    sent = qso.get("station_callsign") or qso.get("operator") or self.callsign or ""
+    return "QSO: %5s %s %s %s %-13s %3s %-6s %-13s %3s %-6s\n" % (
+      freq, mode, date, qso.get("time_on", "")[:4], sent.upper(),
+      qso.get("rst_sent", ""), qso.get("stx_string", qso.get("stx", "")),
+      qso.get("call", ""), qso.get("rst_rcvd", ""), qso.get("srx_string", qso.get("srx", "")))
+
+class CsvSink(Sink):
+  FIELDS = [ "qso_date", "time_on", "call", "mode", "band", "freq", "rst_sent", "rst_rcvd", "operator", "gridsquare", "comment" ]
+
+  def __init__(self, fn, fields=None, **options):
+    Sink.__init__(self, fn)
+    self.fields = fields or self.FIELDS
+    # the csv module writes to a file object, write() keeps the last line
+    self.writer = csv.writer(self)
+    self.head = self.row(self.fields)
+
+  def write(self, line):
+    self.line = line
+
+  def row(self, values):
+    self.writer.writerow(values)
+    return self.line
+
+  def format(self, qso):
+    return self.row([qso.get(f, "") for f in self.fields])
+
+class JsonlSink(Sink):
+  def format(self, qso):
+    qso = dict(qso.items())
+    try:
+      return json.dumps(qso, sort_keys=True) + "\n"
+    except UnicodeDecodeError:
+      # not UTF-8, keep the bytes as they are
+      return json.dumps(qso, sort_keys=True, encoding="latin-1") + "\n"
+
+FORMATS = {
+  "adif": AdifSink,
+  "smff": SmffSink,
+  "adx": AdxSink,
+  "cabrillo": CabrilloSink,
+  "csv": CsvSink,
+  "jsonl": JsonlSink }
+EXTENSIONS = {
+  ".adi": "adif",
+  ".adif": "adif",
+  ".adx": "adx",
+  ".cbr": "cabrillo",
+  ".csv": "csv",
+  ".jsonl": "jsonl" }
+
+def sink(output, **options):
+  # the sink for an output given as format:filename or filename
+  kind, sep, fn = output.partition(":")
+  if not sep or kind.lower() not in FORMATS:
+    fn = output
+    base = fn[:-len(adif.compression(fn))] if adif.compression(fn) else fn
+    kind = EXTENSIONS.get(os.path.splitext(base)[1].lower())
+    if kind is None:
+      raise ValueError("unknown export format, use one of %s: %s" % (", ".join(sorted(FORMATS)), output))
+  return FORMATS[kind.lower()](fn, **options)
+
+def export(qsos, sinks):
+  # one pass over qsos, every QSO goes to every sink. Returns the number of
+  # QSOs, on an error no output is changed.
+  n = 0
+  try:
+    for qso in qsos:
+      for s in sinks:
+        s.add(qso)
+      n += 1
+    for s in sinks:
+      s.close()
+  except:
+    for s in sinks:
+      s.abort()
+    raise
+  return n
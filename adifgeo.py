@@ -0,0 +1,124 @@
+# adifgeo.py - great-circle distance and bearing from Maidenhead locators
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# locate() computes DISTANCE (km) and ANT_AZ (degrees from north, the short
+# path from MY_GRIDSQUARE to GRIDSQUARE) for QSOs that lack them. QSOs are
+# taken adif.WRITE_BATCH at a time and the trigonometry is done for the whole
+# batch at once, with NumPy if it is installed. The same few grids repeat in
+# thousands of QSOs, so latlon() keeps the grids it has converted.
+import re
+import math
+import itertools
+try:
+  import numpy
+except ImportError:
+  numpy = None
+import adif
+
+# mean earth radius in km
+EARTH_RADIUS = 6371.0
+GRID_RE = re.compile(r'^[A-R]{2}(?:[0-9]{2}(?:[A-X]{2}(?:[0-9]{2})?)?)?$', re.I)
+# grids latlon() keeps, the cache starts over when it is full
+GRIDS_CACHED = 1 << 16
+
+_grids = dict()
+
+def _latlon(grid):
+  g = grid.upper()
+  lon = (ord(g[0]) - 65) * 20.0 - 180.0
+  lat = (ord(g[1]) - 65) * 10.0 - 90.0
+  w, h = 20.0, 10.0
+  if len(g) >= 4:
+    w, h = w / 10, h / 10
+    lon += int(g[2]) * w
+    lat += int(g[3]) * h
+  if len(g) >= 6:
+    w, h = w / 24, h / 24
+    lon += (ord(g[4]) - 65) * w
+    lat += (ord(g[5]) - 65) * h
+  if len(g) >= 8:
+    w, h = w / 10, h / 10
+    lon += int(g[6]) * w
+    lat += int(g[7]) * h
+  return lat + h / 2, lon + w / 2
+
+def latlon(grid):
+  # (latitude, longitude) in degrees of the center of a 2, 4, 6 or 8
+  # character locator, None if grid is not one
+  grid = grid.strip()
+  try:
+    return _grids[grid]
+  except KeyError:
+    pass
+  ll = _latlon(grid) if GRID_RE.match(grid) else None
+  if len(_grids) >= GRIDS_CACHED:
+    _grids.clear()
+  _grids[grid] = ll
+  return ll
+
+def distances(pairs):
+  # pairs is [((lat1, lon1), (lat2, lon2)),...] in degrees, returns
+  # [(km, bearing),...] for the short path from the first point to the second
+  if not pairs:
+    return []
+  if numpy is not None:
+    a = numpy.radians(numpy.array(pairs, dtype=float).reshape(len(pairs), 4))
+    lat1, lon1, lat2, lon2 = a[:,0], a[:,1], a[:,2], a[:,3]
+    dlon = lon2 - lon1
+    h = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin(dlon / 2) ** 2
+    km = 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(h, 1.0)))
+    az = numpy.degrees(numpy.arctan2(numpy.sin(dlon) * numpy.cos(lat2),
+      numpy.cos(lat1) * numpy.sin(lat2) - numpy.sin(lat1) * numpy.cos(lat2) * numpy.cos(dlon))) % 360
+    return zip(km.tolist(), az.tolist())
+  result = list()
+  sin, cos, rad = math.sin, math.cos, math.radians
+  for (lat1, lon1), (lat2, lon2) in pairs:
+    lat1, lon1, lat2, lon2 = rad(lat1), rad(lon1), rad(lat2), rad(lon2)
+    dlon = lon2 - lon1
+    h = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
+    km = 2 * EARTH_RADIUS * math.asin(math.sqrt(min(h, 1.0)))
+    az = math.degrees(math.atan2(sin(dlon) * cos(lat2), cos(lat1) * sin(lat2) - sin(lat1) * cos(lat2) * cos(dlon))) % 360
+    result.append((km, az))
+  return result
+
+def _fields(km, az):
+  fields = dict()
+  if km is not None:
+    fields["distance"] = "%.0f" % km
+  if az is not None:
+    fields["ant_az"] = "%.0f" % (round(az) % 360)
+  return fields
+
+def locate(qsos, mygrid=None):
+  # yields (qso, fields) for every QSO of qsos, fields has DISTANCE and/or
+  # ANT_AZ for a QSO that lacks them and has a GRIDSQUARE and MY_GRIDSQUARE
+  # (mygrid if it has none), otherwise it is empty
+  qsos = iter(qsos)
+  while True:
+    batch = list(itertools.islice(qsos, adif.WRITE_BATCH))
+    if not batch:
+      return
+    todo = list()
+    pairs = list()
+    for i, qso in enumerate(batch):
+      if "distance" in qso and "ant_az" in qso:
+        continue
+      there = latlon(qso.get("gridsquare") or "")
+      here = latlon(qso.get("my_gridsquare") or mygrid or "")
+      if there is not None and here is not None:
+        todo.append(i)
+        pairs.append((here, there))
+    found = dict(zip(todo, distances(pairs)))
+    for i, qso in enumerate(batch):
+      if i not in found:
+        yield qso, {}
+        continue
+      km, az = found[i]
+      yield qso, _fields(None if "distance" in qso else km, None if "ant_az" in qso else az)
+
+def fill(qsos, mygrid=None):
+  # the QSOs of qsos with the fields from locate() set
+  for qso, fields in locate(qsos, mygrid):
+    for k, v in fields.items():
+      qso[k] = v
+    yield qso
@@ -0,0 +1,75 @@
+# adifquery.py - compile field conditions into a QSO predicate
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# A query is one or more terms "field op value" separated by white space (use
+# quotes for values with spaces), all terms must match:
+#
+#   band=20m mode=CW|SSB call~^SM date>=20210101 qsl_rcvd!=Y
+#
+#   =, !=     value is (not) one of the |-separated values, ignoring case
+#   ~, !~     value does (not) match the regular expression, ignoring case
+#   <, <=, >, >=
+#             compared as numbers if the given value is a number, otherwise
+#             as strings
+#
+# date and time are short for qso_date and time_on. A QSO without the field
+# only matches != and !~. The query is turned into the source of a single
+# function which is compiled once, so testing a QSO costs about as much as
+# hand written code would.
+import re
+import shlex
+
+ALIASES = { "date": "qso_date", "time": "time_on" }
+TERM_RE = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)(!=|!~|<=|>=|=|~|<|>)(.*)$', re.S)
+
+def _num(v):
+  try:
+    return float(v)
+  except ValueError:
+    return None
+
+def terms(query):
+  # query is a string or a list of strings, returns [(field, op, value),...]
+  # with field in lower case and aliases resolved
+  if isinstance(query, basestring):
+    query = [query]
+  result = list()
+  for term in [term for q in query for term in shlex.split(q)]:
+    m = TERM_RE.match(term)
+    assert m, "not a query term, expected field=value etc: %s" % term
+    field, op, value = m.groups()
+    result.append((ALIASES.get(field.lower(), field.lower()), op, value))
+  return result
+
+def predicate(query):
+  # query is a string or a list of strings. Returns a function taking a QSO
+  # and returning True if it matches, with the field names the query looks at
+  # in its fields attribute.
+  ns = { "num": _num }
+  fields = list()
+  code = [ "def match(q):", "  g = q.get" ]
+  for i, (field, op, value) in enumerate(terms(query)):
+    fields.append(field)
+    c = "c%i" % i
+    code.append("  v = g(%r)" % field)
+    if op in ("=", "!="):
+      ns[c] = frozenset(v.lower() for v in value.split("|"))
+      test = "v is not None and v.lower() in %s" % c
+    elif op in ("~", "!~"):
+      ns[c] = re.compile(value, re.I).search
+      test = "v is not None and %s(v) is not None" % c
+    elif _num(value) is not None:
+      ns[c] = _num(value)
+      test = "v is not None and num(v) is not None and num(v) %s %s" % (op, c)
+    else:
+      ns[c] = value
+      test = "v is not None and v %s %s" % (op, c)
+    if op.startswith("!"):
+      code.append("  if %s: return False" % test)
+    else:
+      code.append("  if not (%s): return False" % test)
+  code.append("  return True")
+  exec("\n".join(code) + "\n", ns)
+  match = ns["match"]
+  match.fields = fields
+  return match
@@ -0,0 +1,159 @@
+# adifstats.py - QSO rates, off-times and histograms for lexa.py -m
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# Stats.add() packs the timestamp of each QSO into an integer array and its
+# band and mode into arrays of small codes, nothing else is kept. report()
+# then works on the whole arrays at once: rolling 10 and 60 minute rates,
+# the busiest clock hour, off-times (gaps of GAP seconds or more without
+# QSOs) and QSOs per band, mode and hour of the day. NumPy is used if it is
+# installed, otherwise the same numbers are computed with plain loops over
+# the arrays.
+import time
+import array
+import adif
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# rolling windows in minutes
+WINDOWS = (10, 60)
+# a gap of at least this many seconds is off-time, as in most contest rules
+GAP = 30 * 60
+# longest gaps listed
+GAPS_LISTED = 5
+
+def _when(t):
+  return time.strftime("%Y-%m-%d %H:%M", time.gmtime(t))
+
+def _duration(seconds):
+  m = seconds // 60
+  d, m = divmod(m, 24 * 60)
+  h, m = divmod(m, 60)
+  if d:
+    return "%dd%02dh%02dm" % (d, h, m)
+  return "%dh%02dm" % (h, m)
+
+def _rate(n, seconds):
+  return n * 3600.0 / seconds
+
+class Stats(object):
+  def __init__(self):
+    self.times = array.array('l')
+    self.bands = array.array('H')
+    self.modes = array.array('H')
+    self.bandcodes = dict()
+    self.modecodes = dict()
+
+  def _code(self, codes, value):
+    c = codes.get(value)
+    if c is None:
+      c = codes[value] = len(codes)
+    return c
+
+  def add(self, qso):
+    # qso needs qso_date and time_on, QSOs without them are not counted
+    if "qso_date" not in qso or "time_on" not in qso:
+      return
+    self.times.append(adif.timestamp(qso))
+    self.bands.append(self._code(self.bandcodes, (qso.get("band") or "").lower()))
+    self.modes.append(self._code(self.modecodes, (qso.get("mode") or "").upper()))
+
+  def __len__(self):
+    return len(self.times)
+
+  def summary(self):
+    # dict with the numbers report() prints, times are seconds since the
+    # epoch
+    if numpy is not None:
+      return self._numpy()
+    return self._python()
+
+  def _numpy(self):
+    t = numpy.frombuffer(self.times, dtype=self.times.typecode)
+    t = numpy.sort(t, kind="mergesort")
+    n = len(t)
+    s = { "qsos": n, "first": int(t[0]), "last": int(t[-1]), "windows": dict() }
+    for w in WINDOWS:
+      # QSOs in [t[i], t[i] + w minutes) for every i
+      counts = numpy.searchsorted(t, t + w * 60, "left") - numpy.arange(n)
+      i = int(counts.argmax())
+      s["windows"][w] = (int(counts[i]), int(t[i]))
+    hours = t // 3600
+    bins = numpy.bincount(hours - hours[0])
+    i = int(bins.argmax())
+    s["peak"] = (int(bins[i]), int((hours[0] + i) * 3600))
+    d = numpy.diff(t)
+    at = numpy.flatnonzero(d >= GAP)
+    s["gaps"] = sorted(((int(d[i]), int(t[i])) for i in at), reverse=True)
+    s["offtime"] = int(d[at].sum())
+    s["bands"] = numpy.bincount(numpy.frombuffer(self.bands, dtype=self.bands.typecode), minlength=len(self.bandcodes)).tolist()
+    s["modes"] = numpy.bincount(numpy.frombuffer(self.modes, dtype=self.modes.typecode), minlength=len(self.modecodes)).tolist()
+    s["hours"] = numpy.bincount(hours % 24, minlength=24).tolist()
+    return s
+
+  def _python(self):
+    t = array.array(self.times.typecode, sorted(self.times))
+    n = len(t)
+    s = { "qsos": n, "first": t[0], "last": t[-1], "windows": dict() }
+    for w in WINDOWS:
+      best, at, j = 0, t[0], 0
+      for i in xrange(n):
+        end = t[i] + w * 60
+        while j < n and t[j] < end:
+          j += 1
+        if j - i > best:
+          best, at = j - i, t[i]
+      s["windows"][w] = (best, at)
+    best, at, count, hour = 0, 0, 0, None
+    hours = [0] * 24
+    for x in t:
+      h = x // 3600
+      hours[h % 24] += 1
+      if h != hour:
+        hour, count = h, 0
+      count += 1
+      if count > best:
+        best, at = count, h * 3600
+    s["peak"] = (best, at)
+    s["hours"] = hours
+    gaps = [(b - a, a) for a, b in zip(t, t[1:]) if b - a >= GAP]
+    s["gaps"] = sorted(gaps, reverse=True)
+    s["offtime"] = sum(d for d, a in gaps)
+    for name, codes, values in (("bands", self.bandcodes, self.bands), ("modes", self.modecodes, self.modes)):
+      counts = [0] * len(codes)
+      for c in values:
+        counts[c] += 1
+      s[name] = counts
+    return s
+
+  def report(self):
+    # the lines lexa.py -m prints after the QSOs
+    if not self.times:
+      return [ "# no QSOs with qso_date and time_on" ]
+    s = self.summary()
+    n = s["qsos"]
+    span = s["last"] - s["first"]
+    ontime = span - s["offtime"]
+    lines = list()
+    if span > 0:
+      lines.append("# QSOs per minute = {:0.2f}, QSOs per hour = {:0.2f}".format(n * 60.0 / span, _rate(n, span)))
+    else:
+      lines.append("# QSOs per minute = n/a, QSOs per hour = n/a (all {} QSOs at {})".format(n, _when(s["first"])))
+    for w in WINDOWS:
+      count, at = s["windows"][w]
+      lines.append("# Best {} minutes: {} QSOs ({:0.1f}/h) from {}".format(w, count, _rate(count, w * 60), _when(at)))
+    count, at = s["peak"]
+    lines.append("# Peak hour: {} QSOs {}-{}".format(count, _when(at), _when(at + 3600)[11:]))
+    if ontime > 0:
+      lines.append("# On-time {}, {:0.1f} QSOs per hour on-time".format(_duration(ontime), _rate(n, ontime)))
+    lines.append("# Off-time {} in {} gaps of {} minutes or more".format(_duration(s["offtime"]), len(s["gaps"]), GAP // 60))
+    for d, at in s["gaps"][:GAPS_LISTED]:
+      lines.append("#   {} from {}".format(_duration(d), _when(at)))
+    for name, codes in (("Bands", self.bandcodes), ("Modes", self.modecodes)):
+      counts = s[name.lower()]
+      lines.append("# {}: {}".format(name, ", ".join("{} {}".format(k or "N/A", counts[c]) for k, c in sorted(codes.items(), key=lambda kc: -counts[kc[1]]))))
+    width = max(2, len(str(max(s["hours"]))))
+    lines.append("# UTC hour: " + " ".join("%*s" % (width, "%02d" % h) for h in range(24)))
+    lines.append("# QSOs:     " + " ".join("%*d" % (width, c) for c in s["hours"]))
+    return lines
@@ -0,0 +1,181 @@
+# adiftime.py - sparse time index (logfile.adif.tix) for reading a date range
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# For a log in qso_date/time_on order the index holds the time of a record
+# about every STEP bytes and where that record starts, so a date range can be
+# read by seeking close to its start and stopping after its end. The index
+# also records whether the log is in order at all, logs that are not are
+# simply read from the beginning and filtered. The index is extended when the
+# log has been appended to and rebuilt when it has been changed otherwise.
+import os
+import re
+import bisect
+import adif
+
+INDEX_VERSION = 1
+STEP = 1 << 16
+
+def indexname(fn):
+  return fn + '.tix'
+
+def key(qso):
+  # qso_date and time_on as a YYYYMMDDHHMMSS string, None if either is missing
+  if "qso_date" not in qso or "time_on" not in qso:
+    return None
+  return qso["qso_date"] + qso["time_on"].ljust(6, "0")
+
+def bound(s, upper=False):
+  # "2021-02-12", "20210212 10:45" etc as a key to compare with key(), an upper
+  # bound includes the whole day, hour or minute given
+  digits = re.sub(r'\D', '', s)
+  assert len(digits) in (8, 10, 12, 14), "date and time must be YYYYMMDD[HH[MM[SS]]]: %s" % s
+  return digits + ("235959" if upper else "000000")[len(digits) - 8:]
+
+def shift(k, seconds):
+  # key k moved by seconds, None stays None
+  if k is None or not seconds:
+    return k
+  import datetime
+  t = datetime.datetime.strptime(k, "%Y%m%d%H%M%S")
+  return (t + datetime.timedelta(seconds=seconds)).strftime("%Y%m%d%H%M%S")
+
+def between(qsos, start=None, end=None):
+  # filters records by key() when they do not come from window()
+  for qso in qsos:
+    k = key(qso)
+    if start is not None and (k is None or k < start):
+      continue
+    if end is not None and (k is None or k > end):
+      continue
+    yield qso
+
+def digest(fn, start, end):
+  # sha1 of the bytes from start to end of fn, to tell whether a log has only
+  # been appended to
+  import hashlib
+  fh = adif.openlog(fn)
+  fh.seek(start)
+  data = fh.read(end - start)
+  fh.close()
+  return hashlib.sha1(data).hexdigest()
+
+def _load(fn):
+  import json
+  idx = indexname(fn)
+  if not os.path.exists(idx):
+    return None
+  try:
+    index = json.load(open(idx))
+  except ValueError:
+    return None
+  if index.get("version") != INDEX_VERSION:
+    return None
+  return index
+
+def update(fn):
+  # returns the index of fn, reading only what has been appended to fn since
+  # the index was saved, or all of fn if it has been changed otherwise
+  st = os.stat(fn)
+  index = _load(fn)
+  if index and index["size"] == st.st_size and index["mtime"] == st.st_mtime:
+    return index
+  offset = 0
+  if index and st.st_size > index["size"] and index["tail"]:
+    start, end, sha1 = index["tail"]
+    if digest(fn, start, end) == sha1:
+      offset = end
+  if not offset:
+    index = { "version": INDEX_VERSION, "sorted": True, "last": None, "tail": None, "entries": [] }
+  entries = index["entries"]
+  last = index["last"]
+  inorder = index["sorted"]
+  marked = entries[-1][1] if entries else -STEP
+  fh = adif.openlog(fn)
+  fh.seek(offset)
+  for tag, qso, start, end in adif.scan(fh, offset=offset):
+    if tag != "eor":
+      continue
+    k = key(qso)
+    if k is None or (last is not None and k < last):
+      inorder = False
+    last = k or last
+    if start - marked >= STEP and k is not None:
+      entries.append([k, start])
+      marked = start
+    index["tail"] = [start, end, None]
+  fh.close()
+  if index["tail"] and index["tail"][2] is None:
+    index["tail"][2] = digest(fn, index["tail"][0], index["tail"][1])
+  index.update(size=st.st_size, mtime=st.st_mtime, sorted=inorder, last=last)
+  import json
+  tmp = indexname(fn) + '.tmp'
+  fh = open(tmp, 'w')
+  json.dump(index, fh)
+  fh.close()
+  os.rename(tmp, indexname(fn))
+  return index
+
+def ordered(fn, build=True):
+  # True if the index of fn (brought up to date first) says fn is in time
+  # order. Unless build is True a log without an index is not indexed just to
+  # find out, it counts as out of order, as does a log whose index cannot be
+  # saved (e.g. in a read-only directory).
+  if not build and not os.path.exists(indexname(fn)):
+    return False
+  try:
+    return update(fn)["sorted"]
+  except (IOError, OSError):
+    return False
+
+def window(fn, start=None, end=None):
+  # yields (qso, start, end) like adif.iterspans() for the records of fn with
+  # start <= key(qso) <= end (bounds from bound(), None for no limit). In an
+  # ordered log only the range and the index step before it are read. If the
+  # index cannot be saved (e.g. in a read-only directory) all of fn is read,
+  # as if it was out of order.
+  if start is None and end is None:
+    for qso, first, last in adif.iterspans(fn):
+      yield qso, first, last
+    return
+  try:
+    index = update(fn)
+  except (IOError, OSError):
+    index = { "sorted": False, "entries": [] }
+  offset = 0
+  if index["sorted"] and start is not None and index["entries"]:
+    keys = [k for k, pos in index["entries"]]
+    i = bisect.bisect_left(keys, start)
+    if i > 0:
+      offset = index["entries"][i - 1][1]
+  fh = adif.openlog(fn)
+  try:
+    fh.seek(offset)
+    for tag, qso, first, last in adif.scan(fh, offset=offset):
+      if tag != "eor":
+        continue
+      k = key(qso)
+      if start is not None and (k is None or k < start):
+        continue
+      if end is not None and (k is None or k > end):
+        if index["sorted"]:
+          return
+        continue
+      yield qso, first, last
+  finally:
+    fh.close()
+
+def iterwindow(fn, start=None, end=None):
+  # the records of window() without their spans
+  for qso, first, last in window(fn, start, end):
+    yield qso
+
+def iterlog(fn, start=None, end=None, query=None):
+  # the QSOs in the date range of a log in any format: a SQLite logbook (also
+  # narrowed down by query, see adifdb.window(), adifdb is only imported for
+  # one), an ADX or an ADIF log
+  if adif.isdb(fn):
+    import adifdb
+    return adifdb.iterwindow(fn, start, end, query)
+  if adif.isadx(fn):
+    return between(adif.iterparse(fn), start, end)
+  return iterwindow(fn, start, end)
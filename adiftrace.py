@@ -0,0 +1,119 @@
+# adiftrace.py - where the scripts spend their time
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# With --profile (or ADIF_TRACE=1 in the environment) a script prints a JSON
+# summary on stderr when it exits: wall time, time and records per stage,
+# counters (bytes read and written, dedup comparisons, ...) and peak memory.
+# --profile-dump file (or ADIF_TRACE_DUMP=file) also runs the script under
+# cProfile and writes the stats to file, see the pstats module.
+#
+# Stage times include everything done while the stage is running, so a stage
+# that reads its records from another stage includes that stage's time too.
+# When tracing is off stage() returns a shared do-nothing object and timed()
+# its argument, and counters are only added to behind an ENABLED check, so
+# the scripts run as they would without this module.
+import os
+import sys
+import time
+import atexit
+
+ENABLED = False
+stages = dict()
+counters = dict()
+started = time.time()
+profiler = None
+
+class _Stage(object):
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    self.t = time.time()
+    return self
+
+  def __exit__(self, *exc):
+    s = _stage(self.name)
+    s["seconds"] += time.time() - self.t
+    s["calls"] += 1
+    return False
+
+class _Off(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+_OFF = _Off()
+
+def _stage(name):
+  s = stages.get(name)
+  if s is None:
+    s = stages[name] = { "seconds": 0.0, "calls": 0, "records": 0 }
+  return s
+
+def stage(name):
+  # with adiftrace.stage("write"): ... adds the time the block takes to stage
+  # name
+  return _Stage(name) if ENABLED else _OFF
+
+def timed(name, iterable):
+  # iterable, with the time spent getting each item and the number of items
+  # added to stage name
+  if not ENABLED:
+    return iterable
+  return _timed(name, iterable)
+
+def _timed(name, iterable):
+  s = _stage(name)
+  s["calls"] += 1
+  it = iter(iterable)
+  clock = time.time
+  while True:
+    t = clock()
+    try:
+      item = next(it)
+    except StopIteration:
+      s["seconds"] += clock() - t
+      return
+    s["seconds"] += clock() - t
+    s["records"] += 1
+    yield item
+
+def add(name, n=1):
+  # adds n to counter name, callers check ENABLED first in loops
+  counters[name] = counters.get(name, 0) + n
+
+def summary():
+  import resource
+  # ru_maxrss is in kilobytes on Linux, bytes on macOS
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+  return {
+    "script": os.path.basename(sys.argv[0]),
+    "wall": time.time() - started,
+    "stages": stages,
+    "counters": counters,
+    "peak_rss": rss }
+
+def _report(dump):
+  import json
+  if profiler is not None:
+    profiler.disable()
+    profiler.dump_stats(dump)
+  sys.stderr.write(json.dumps(summary(), sort_keys=True) + "\n")
+
+def enable(dump=None):
+  # turns tracing on for the rest of the run and reports at exit, dump is the
+  # file for cProfile stats or None
+  global ENABLED, profiler
+  if ENABLED:
+    return
+  ENABLED = True
+  if dump:
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+  atexit.register(_report, dump)
+
+if os.environ.get("ADIF_TRACE", "0") not in ("", "0") or os.environ.get("ADIF_TRACE_DUMP"):
+  enable(os.environ.get("ADIF_TRACE_DUMP"))
@@ -0,0 +1,168 @@
+# adifvalidate.py - find bad records in ADIF logs before they are imported
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# check() streams the records of a log and yields (line, message) for every
+# problem found, so one run reports all of them instead of the first
+# assertion deep inside an import:
+#
+#   - required fields missing (call, qso_date, time_on, band and mode, which
+#     duplicates are matched on, or e.g. what SMFF needs)
+#   - qso_date/qso_date_off not a YYYYMMDD date, time_on/time_off not HHMM or
+#     HHMMSS
+#   - freq not a number, band not an ADIF band or freq outside of band (the
+#     band of a frequency is looked up with bisect in adif.BANDS, a freq in
+#     kHz is accepted, see adif.megahertz())
+#   - a declared length that does not match the value, e.g. <call:4>SM6XYZ
+#     (the value is cut short) or a length that runs past <eor>
+#
+# The checks for each field are compiled once into a table of functions,
+# checking a record costs about as much as parsing it. Line numbers count
+# from 1. ADX logs and SQLite logbooks have no lines, problems are reported by
+# record number.
+import re
+import calendar
+import adif
+import adiftime
+
+REQUIRED = ("call", "qso_date", "time_on", "band", "mode")
+DATE_RE = re.compile(r'^(19[3-9]\d|2\d\d\d)(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])$')
+TIME_RE = re.compile(r'^([01]\d|2[0-3])[0-5]\d([0-5]\d)?$')
+NUMBER_RE = re.compile(r'^\s*-?(\d+\.?\d*|\.\d+)\s*$')
+
+def _date(k, v):
+  m = DATE_RE.match(v)
+  if m is None:
+    return "%s is not a YYYYMMDD date: %r" % (k, v)
+  if v[6:] > "28" and int(v[6:]) > calendar.monthrange(int(v[:4]), int(v[4:6]))[1]:
+    return "%s is not a date: %r" % (k, v)
+
+def _time(k, v):
+  if TIME_RE.match(v) is None:
+    return "%s is not a HHMM or HHMMSS time: %r" % (k, v)
+
+def _number(k, v):
+  if NUMBER_RE.match(v) is None:
+    return "%s is not a number: %r" % (k, v)
+
+def _band(k, v):
+  if v.lower() not in adif.BAND_NAMES:
+    return "%s is not an ADIF band: %r" % (k, v)
+
+VALIDATORS = {
+  "qso_date": _date,
+  "qso_date_off": _date,
+  "time_on": _time,
+  "time_off": _time,
+  "freq": _number,
+  "freq_rx": _number,
+  "tx_pwr": _number,
+  "band": _band,
+  "band_rx": _band }
+_VALIDATORS = sorted(VALIDATORS.items())
+
+def problems(qso, required=REQUIRED):
+  # the problems with the fields of qso, a list of messages
+  found = list()
+  for k in required:
+    if not qso.get(k):
+      found.append("required field %s is missing" % k)
+  for k, f in _VALIDATORS:
+    v = qso.get(k)
+    if v is not None:
+      msg = f(k, v)
+      if msg is not None:
+        found.append(msg)
+  freq, b = qso.get("freq"), qso.get("band")
+  if freq and b and NUMBER_RE.match(freq) and b.lower() in adif.BAND_NAMES:
+    # a FREQ in kHz, as termlog writes it, is read as such
+    actual = adif.band(adif.megahertz(freq))
+    if actual != b.lower():
+      found.append("freq %s is %s, not band %s" % (freq.strip(), "in " + actual if actual else "outside of all bands", b))
+  return found
+
+_names = dict()
+
+def _fields(buf, start, end):
+  # (qso, [(offset, message),...]) for the record buf[start:end] (up to its
+  # <eor>), going by the declared lengths
+  qso = dict()
+  # as adif.scan() does if every value fits its length, the usual case
+  fields = adif.ADIF_FIELD_RE.findall(buf, start, end)
+  if len(fields) == buf.count("<", start, end):
+    for name, length, text in fields:
+      n = int(length)
+      if n > len(text) or text[n:].strip():
+        break
+      lname = _names.get(name)
+      if lname is None:
+        lname = _names[name] = intern(name.lower())
+      qso[lname] = text[:n]
+    else:
+      return qso, []
+    qso.clear()
+  found = list()
+  pos = start
+  while True:
+    m = adif.ADIF_TOKEN_RE.search(buf, pos, end)
+    if m is None:
+      return qso, found
+    name, length = m.group(1, 2)
+    if length is None:
+      found.append((m.start(), "<%s> has no length" % name))
+      pos = m.end(1)
+      continue
+    vstart = m.start(3)
+    vend = vstart + int(length)
+    if vend > end:
+      found.append((m.start(), "declared length %s of %s runs past <eor>" % (length, name)))
+      qso[name.lower()] = buf[vstart:end]
+      return qso, found
+    qso[name.lower()] = buf[vstart:vend]
+    if vend < m.end(3):
+      rest = buf[vend:m.end(3)]
+      if rest.strip():
+        found.append((m.start(), "declared length %s of %s is shorter than its value %r" % (length, name, buf[vstart:m.end(3)].rstrip())))
+      pos = m.end(3)
+    else:
+      # the value contains "<", continue after it
+      pos = vend
+
+def check(fn, required=REQUIRED):
+  # yields (line, message) for the problems in fn in file order, for ADX logs
+  # and SQLite logbooks (record number, message)
+  if adif.isdb(fn) or adif.isadx(fn):
+    for n, qso in enumerate(adiftime.iterlog(fn), 1):
+      for msg in problems(qso, required):
+        yield n, msg
+    return
+  fh = adif.openlog(fn)
+  try:
+    buf = fh.read(adif.CHUNK_SIZE)
+    eof = not buf
+    pos = 0
+    line = 1 # line number at buf[pos]
+    while True:
+      for m in adif.ADIF_END_RE.finditer(buf, pos):
+        # the header (up to <eoh>) is not checked
+        if m.group(1).lower() == "eor":
+          qso, found = _fields(buf, pos, m.start())
+          msgs = problems(qso, required)
+          if msgs:
+            # reported at the line the record starts on
+            found += [(adif.ADIF_TOKEN_RE.search(buf, pos).start(), msg) for msg in msgs]
+            found.sort(key=lambda f: f[0])
+          for offset, msg in found:
+            yield line + buf.count("\n", pos, offset), msg
+        line += buf.count("\n", pos, m.end())
+        pos = m.end()
+      if eof:
+        first = adif.ADIF_TOKEN_RE.search(buf, pos)
+        if first is not None:
+          yield line + buf.count("\n", pos, first.start()), "record without <eor> at the end of the log"
+        return
+      chunk = fh.read(adif.CHUNK_SIZE)
+      eof = not chunk
+      buf = buf[pos:] + chunk
+      pos = 0
+  finally:
+    fh.close()
@@ -0,0 +1,177 @@
+# adifworked.py - worked-before index of the calls in one or more logs
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# The index (worked.idx unless named otherwise) maps every call to the bands
+# and modes it has been worked on, each with the DXCC entity, the first and
+# last date and time (adiftime.key()) and the number of QSOs:
+#
+#   { "SM6XYZ": [["20m", "CW", "284", "20190101104500", "20210212110000", 3],
+#                ["40m", "SSB", ...]], ... }
+#
+# together with the calls in sorted order, so that calls starting with a
+# partial call are found by bisecting to the first one and reading on until
+# the prefix no longer matches. The index is a marshal file that loads in one
+# go. For each log it remembers the size, modification time and last record
+# (as adiftime.py does), update() only reads what has been appended to a log
+# since and starts over from all logs if one has been changed otherwise.
+# SQLite (adifdb.py) and ADX logs are read in full whenever they have changed.
+import os
+import bisect
+import fnmatch
+import marshal
+import adif
+import adiftime
+
+INDEX_VERSION = 1
+DEFAULT = "worked.idx"
+# fields of an entry
+BAND, MODE, DXCC, FIRST, LAST, COUNT = range(6)
+
+def _empty():
+  return { "version": INDEX_VERSION, "logs": dict(), "calls": dict(), "sorted": [] }
+
+def load(fn=DEFAULT):
+  # the index saved in fn, an empty index if there is none (or it is from
+  # another version)
+  if not os.path.exists(fn):
+    return _empty()
+  fh = open(fn, 'rb')
+  try:
+    index = marshal.load(fh)
+  except (EOFError, ValueError, TypeError):
+    return _empty()
+  finally:
+    fh.close()
+  if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+    return _empty()
+  return index
+
+def save(fn, index):
+  index["sorted"] = sorted(index["calls"])
+  fh, tmp = adif.mkstemp(fn)
+  try:
+    marshal.dump(index, fh)
+    fh.flush()
+    os.fsync(fh.fileno())
+  except:
+    fh.close()
+    os.unlink(tmp)
+    raise
+  fh.close()
+  adif.replacefile(fn, tmp)
+
+def add(index, qso):
+  # counts qso in index, QSOs without a call are skipped
+  call = (qso.get("call") or "").strip().upper()
+  if not call:
+    return
+  band = (qso.get("band") or "").lower()
+  mode = (qso.get("mode") or "").upper()
+  k = adiftime.key(qso) or ""
+  entries = index["calls"].get(call)
+  if entries is None:
+    entries = index["calls"][call] = list()
+  for e in entries:
+    if e[BAND] == band and e[MODE] == mode:
+      if k and (not e[FIRST] or k < e[FIRST]):
+        e[FIRST] = k
+      if k > e[LAST]:
+        e[LAST] = k
+      if not e[DXCC] and qso.get("dxcc"):
+        e[DXCC] = qso["dxcc"]
+      e[COUNT] += 1
+      return
+  entries.append([band, mode, qso.get("dxcc") or "", k, k, 1])
+
+def _read(index, fn, offset):
+  # adds the QSOs of fn from offset on to index, returns the new log entry
+  st = os.stat(fn)
+  log = { "size": st.st_size, "mtime": st.st_mtime, "tail": None }
+  if adif.isdb(fn) or adif.isadx(fn):
+    for qso in adiftime.iterlog(fn):
+      add(index, qso)
+    return log
+  fh = adif.openlog(fn)
+  try:
+    fh.seek(offset)
+    for tag, qso, start, end in adif.scan(fh, offset=offset):
+      if tag == "eor":
+        add(index, qso)
+        log["tail"] = [start, end]
+  finally:
+    fh.close()
+  if log["tail"]:
+    log["tail"].append(adiftime.digest(fn, *log["tail"]))
+  return log
+
+def _appended(fn, log):
+  # the offset to read fn from if it has only been appended to since log was
+  # recorded, None if it has to be read from the start
+  st = os.stat(fn)
+  if not log.get("tail") or st.st_size <= log["size"]:
+    return None
+  start, end, sha1 = log["tail"]
+  if adiftime.digest(fn, start, end) != sha1:
+    return None
+  return end
+
+def update(fn, logs):
+  # returns the index in fn with the QSOs of logs added, reading only what
+  # has been appended to the logs already in the index. The index is saved if
+  # anything changed.
+  index = load(fn)
+  known = index["logs"]
+  logs = [os.path.abspath(f) for f in logs]
+  todo = list()
+  for f in logs:
+    log = known.get(f)
+    if log is None:
+      todo.append((f, 0))
+      continue
+    st = os.stat(f)
+    if st.st_size == log["size"] and st.st_mtime == log["mtime"]:
+      continue
+    offset = _appended(f, log)
+    if offset is None:
+      # QSOs counted from f may be gone, count all logs again
+      todo = None
+      break
+    todo.append((f, offset))
+  if todo is None:
+    everything = [f for f in known if os.path.exists(f)]
+    index = _empty()
+    todo = [(f, 0) for f in everything + [f for f in logs if f not in everything]]
+  if not todo:
+    return index
+  for f, offset in todo:
+    index["logs"][f] = _read(index, f, offset)
+  save(fn, index)
+  return index
+
+def lookup(index, call, band=None, mode=None):
+  # the entries [band, mode, dxcc, first, last, count] of call, only those on
+  # band and/or mode if given, [] if call has not been worked
+  entries = index["calls"].get(call.strip().upper(), [])
+  if band:
+    entries = [e for e in entries if e[BAND] == band.lower()]
+  if mode:
+    entries = [e for e in entries if e[MODE] == mode.upper()]
+  return entries
+
+def calls(index, pattern):
+  # worked calls matching pattern, a call, a partial call ending in * (found
+  # through the sorted calls) or any other pattern with * and ? (checked
+  # against every call)
+  pattern = pattern.strip().upper()
+  if "*" not in pattern and "?" not in pattern:
+    return [pattern] if pattern in index["calls"] else []
+  prefix = pattern[:-1]
+  if pattern.endswith("*") and "*" not in prefix and "?" not in prefix:
+    found = list()
+    ordered = index["sorted"]
+    i = bisect.bisect_left(ordered, prefix)
+    while i < len(ordered) and ordered[i].startswith(prefix):
+      found.append(ordered[i])
+      i += 1
+    return found
+  return fnmatch.filter(index["sorted"], pattern)
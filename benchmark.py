@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# benchmark.py - time the scripts on synthetic logs
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# Generates a termlog style log (one field per line, lower case tags) and a
+# WSJT-X style *-ft8-auto.adif log (one record per line, upper case tags) with
+# the given number of QSOs between them, a share of the ft8 log being
+# duplicates of QSOs in the termlog log. Then runs each benchmark in a process
+# of its own and reports its time, records per second and peak RSS. Results
+# can be saved as a baseline and later runs compared against it, a benchmark
+# that has become slower than the baseline by more than the threshold is a
+# regression and makes the exit status 1.
+import sys, getopt, os
+import json
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import adif
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS = [ "parse", "sort", "save", "dedup", "aggregate", "list", "export", "smff" ]
+PREFIXES = [ "SA", "SM", "SK", "OH", "LA", "OZ", "DL", "DK", "F", "G", "M", "I", "EA", "PA", "ON", "OK", "SP", "HA", "S5", "9A", "YU", "UA", "K", "W", "N", "VE", "JA" ]
+BANDS = [ ("80m", 3.573), ("40m", 7.074), ("30m", 10.136), ("20m", 14.074), ("17m", 18.100), ("15m", 21.074), ("10m", 28.074) ]
+GRIDS = "ABCDEFGHIJKLMNOPQR"
+EXTRA = [ "comment", "notes", "name", "qth", "email", "app_pskrep_snr", "dxcc", "distance", "cqz", "ituz" ]
+
+def callsign(rnd):
+  suffix = "".join(rnd.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for i in range(rnd.randint(1, 3)))
+  return "%s%i%s" % (rnd.choice(PREFIXES), rnd.randint(0, 9), suffix)
+
+def gridsquare(rnd):
+  return "%s%s%i%i" % (rnd.choice(GRIDS), rnd.choice(GRIDS), rnd.randint(0, 9), rnd.randint(0, 9))
+
+def qsos(rnd, n, ft8, extra, t):
+  # yields n (timestamp, qso) pairs, QSOs a few minutes apart from t on
+  for i in xrange(n):
+    t += rnd.randint(30, 600)
+    band, freq = rnd.choice(BANDS)
+    tm = time.gmtime(t)
+    qso = {
+      "call": callsign(rnd),
+      "qso_date": time.strftime("%Y%m%d", tm),
+      "band": band,
+      "gridsquare": gridsquare(rnd) }
+    if ft8:
+      qso.update({
+        "time_on": time.strftime("%H%M%S", tm),
+        "time_off": time.strftime("%H%M%S", time.gmtime(t + 75)),
+        "qso_date_off": time.strftime("%Y%m%d", time.gmtime(t + 75)),
+        "mode": "FT8",
+        "freq": "%.6f" % (freq + rnd.randint(200, 2800) / 1e6),
+        "rst_sent": "%+03i" % rnd.randint(-24, 10),
+        "rst_rcvd": "%+03i" % rnd.randint(-24, 10),
+        "my_gridsquare": "JO57xq",
+        "station_callsign": "SA6MWA",
+        "tx_pwr": rnd.choice(["5", "10", "25"]) })
+    else:
+      qso.update({
+        "time_on": time.strftime("%H%M", tm),
+        "mode": rnd.choice(["CW", "SSB"]),
+        "freq": "%.2f" % (freq * 1000 - 40 + rnd.randint(0, 200) / 10.0),
+        "rst_sent": "599",
+        "rst_rcvd": rnd.choice(["599", "579", "559"]) })
+    for k in rnd.sample(EXTRA, extra):
+      qso[k] = "%s %i" % (k, rnd.randint(1, 10000))
+    yield t, qso
+
+def termlog_record(qso):
+  return "".join("<%s:%i>%s\n" % (k, len(v), v) for k, v in sorted(qso.items())) + "<eor>\n\n"
+
+def generate(workdir, n, ft8share, dupes, extra, seed):
+  # writes termlog.adif and bench-ft8-auto.adif to workdir, returns
+  # {"termlog": records, "ft8": records}
+  rnd = random.Random(seed)
+  nft8 = int(n * ft8share)
+  nterm = n - nft8
+  start = 1546300800 # 2019-01-01
+  termlog = [qso for t, qso in qsos(rnd, nterm, False, extra, start)]
+  adif.save(os.path.join(workdir, "termlog.adif"),
+    "<adif_ver:5>3.0.8\n<programid:7>termlog\n<operator:6>SA6MWA\n<eoh>\n\n",
+    termlog, termlog_record)
+  def ft8log():
+    for t, qso in qsos(rnd, nft8, True, extra, start):
+      if termlog and rnd.random() < dupes:
+        yield rnd.choice(termlog)
+      else:
+        yield qso
+  adif.save(os.path.join(workdir, "bench-ft8-auto.adif"),
+    "Log: bench-ft8-auto.adif\nGenerated by SA6MWA benchmark.py\n<EOH>\n", ft8log())
+  return { "termlog": nterm, "ft8": nft8 }
+
+def case(name, workdir):
+  # runs benchmark name in this process and prints the seconds its timed part
+  # took, for benchmarks that are only part of a script
+  ft8 = os.path.join(workdir, "bench-ft8-auto.adif")
+  if name == "parse":
+    t = time.time()
+    adif.parse(ft8)
+  elif name == "sort":
+    logbook = adif.parse(ft8)
+    random.Random(1).shuffle(logbook)
+    t = time.time()
+    for qso in adif.merge([logbook]):
+      pass
+  elif name == "save":
+    logbook = adif.parse(ft8)
+    t = time.time()
+    adif.save(os.path.join(workdir, "save.adif"), "<EOH>\n", logbook)
+  print json.dumps({ "seconds": time.time() - t })
+
+def commands(workdir):
+  # {benchmark: command}, each is run in workdir
+  py = sys.executable
+  script = lambda name: os.path.join(HERE, name)
+  ft8 = "bench-ft8-auto.adif"
+  return {
+    "parse": [py, script("benchmark.py"), "--case", "parse", workdir],
+    "sort": [py, script("benchmark.py"), "--case", "sort", workdir],
+    "save": [py, script("benchmark.py"), "--case", "save", workdir],
+    "dedup": [py, script("import.py"), "-n", "-a", "termlog.adif", ft8],
+    "aggregate": [py, script("adifaggregator.py"), "--force"],
+    "list": [py, script("lexa.py"), ft8],
+    "export": [py, script("lexa.py"), "-e", "export.adif", ft8],
+    "smff": [py, script("termlog2smff-activator.py"), "-o", "smff.adi", "-c", "SA6MWA", "-s", "3509", "termlog.adif"] }
+
+def run(command, workdir):
+  # runs command in workdir, returns (seconds, peak RSS in bytes, output)
+  for fn in ("export.adif", "smff.adi", "save.adif", "all.adif", "all.adif.manifest"):
+    if os.path.exists(os.path.join(workdir, fn)):
+      os.unlink(os.path.join(workdir, fn))
+  devnull = open(os.devnull, 'w')
+  out = tempfile.TemporaryFile()
+  t = time.time()
+  p = subprocess.Popen(command, cwd=workdir, stdout=out, stderr=devnull)
+  pid, status, usage = os.wait4(p.pid, 0)
+  seconds = time.time() - t
+  # reaped by wait4() already, Popen must not wait for it again
+  p.returncode = status
+  devnull.close()
+  out.seek(0)
+  output = out.read()
+  out.close()
+  if status != 0:
+    raise RuntimeError("%s failed with status %i" % (" ".join(command), status))
+  # ru_maxrss is in kilobytes on Linux, bytes on macOS
+  rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+  return seconds, rss, output
+
+def usage():
+  print """usage: {} [-n qsos] [-d ratio] [-f share] [-x fields] [-b baseline.json] [-s baseline.json] [-t percent] [-k] [benchmark...]
+  Times the scripts on generated logs, benchmarks are {}
+  (all by default).
+  -n, --qsos qsos          Number of QSOs to generate (default 10000)
+  -d, --dupes ratio        Share of the ft8 log that duplicates QSOs of the
+                           termlog log (default 0.1)
+  -f, --ft8 share          Share of the QSOs in the ft8 log (default 0.5)
+  -x, --extra fields       Number of extra fields (comment, notes, ...) per QSO
+                           (default 2)
+  -b, --baseline file      Compare with the results in file
+  -s, --save file          Save the results to file, as a baseline
+  -t, --threshold percent  Slowdown from the baseline that is a regression
+                           (default 10)
+  -k, --keep               Keep the generated logs, the directory is printed
+""".format(sys.argv[0], ", ".join(BENCHMARKS)),
+
+def main():
+  if sys.argv[1:2] == ["--case"]:
+    case(sys.argv[2], sys.argv[3])
+    return
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "hn:d:f:x:b:s:t:k", ["help","qsos=","dupes=","ft8=","extra=","baseline=","save=","threshold=","keep"])
+  except getopt.GetoptError as err:
+    print str(err)
+    usage()
+    sys.exit(2)
+  n = 10000
+  dupes = 0.1
+  ft8share = 0.5
+  extra = 2
+  baseline = None
+  savefile = None
+  threshold = 10.0
+  keep = False
+  for o, a in opts:
+    if o in ("-h", "--help"):
+      usage()
+      sys.exit()
+    elif o in ("-n", "--qsos"):
+      n = int(a)
+    elif o in ("-d", "--dupes"):
+      dupes = float(a)
+    elif o in ("-f", "--ft8"):
+      ft8share = float(a)
+    elif o in ("-x", "--extra"):
+      extra = min(int(a), len(EXTRA))
+    elif o in ("-b", "--baseline"):
+      baseline = json.load(open(a))
+    elif o in ("-s", "--save"):
+      savefile = a
+    elif o in ("-t", "--threshold"):
+      threshold = float(a)
+    elif o in ("-k", "--keep"):
+      keep = True
+    else:
+      assert False, "unhandled option"
+  names = args or BENCHMARKS
+  for name in names:
+    if name not in BENCHMARKS:
+      print "error: unknown benchmark %s, choose from %s" % (name, ", ".join(BENCHMARKS))
+      sys.exit(2)
+  workdir = tempfile.mkdtemp(prefix="adifbench.")
+  regressions = 0
+  try:
+    counts = generate(workdir, n, ft8share, dupes, extra, 1)
+    records = {
+      "parse": counts["ft8"], "sort": counts["ft8"], "save": counts["ft8"],
+      "dedup": counts["ft8"], "aggregate": n, "list": counts["ft8"],
+      "export": counts["ft8"], "smff": counts["termlog"] }
+    cmds = commands(workdir)
+    results = { "qsos": n, "dupes": dupes, "ft8": ft8share, "extra": extra, "python": sys.version.split()[0], "benchmarks": {} }
+    print "# %i QSOs (%i termlog, %i ft8, %.0f%% duplicates), %i extra fields" % (n, counts["termlog"], counts["ft8"], dupes * 100, extra)
+    print "{:10s} {:>9s} {:>9s} {:>12s} {:>9s}  {}".format("BENCHMARK", "RECORDS", "SECONDS", "RECORDS/S", "PEAK MB", "BASELINE")
+    for name in names:
+      seconds, rss, output = run(cmds[name], workdir)
+      if output.startswith("{"):
+        # only the timed part of the case
+        seconds = json.loads(output)["seconds"]
+      rate = records[name] / seconds if seconds > 0 else 0.0
+      results["benchmarks"][name] = { "records": records[name], "seconds": seconds, "rate": rate, "rss": rss }
+      compared = ""
+      if baseline and name in baseline.get("benchmarks", {}):
+        base = baseline["benchmarks"][name]["rate"]
+        change = (rate - base) / base * 100 if base else 0.0
+        compared = "%+.1f%%" % change
+        if change < -threshold:
+          compared += " REGRESSION"
+          regressions += 1
+      print "{:10s} {:9d} {:9.3f} {:12.0f} {:9.1f}  {}".format(name, records[name], seconds, rate, rss / 1048576.0, compared)
+      sys.stdout.flush()
+    if baseline and baseline.get("qsos") != n:
+      print "# the baseline was made with %s QSOs, rates may not compare" % baseline.get("qsos")
+    if savefile:
+      fh = open(savefile, 'w')
+      json.dump(results, fh, indent=2, sort_keys=True)
+      fh.close()
+      print "Saved " + savefile
+  finally:
+    if keep:
+      print "Logs are in " + workdir
+    else:
+      shutil.rmtree(workdir)
+  if regressions:
+    sys.exit(1)
+if __name__ == '__main__':
+  main()
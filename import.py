@@ -3,95 +3,213 @@
 # DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
 # based on ADIF.PY by OK4BX http://web.bxhome.org
 import sys, getopt, os
-import re
-import datetime
-import time
-import glob
-ADIF_REC_RE = re.compile(r'<(.*?):(\d+).*?>([^<\t\f\v]+)')
-
-def parse(fn):
-  raw = re.split('<eor>|<eoh>(?i)', open(fn).read() )
-  logbook =[]
-  for record in raw[1:-1]:
-    qso = {}
-    tags = ADIF_REC_RE.findall(record)
-    for tag in tags:
-      qso[tag[0].lower()] = tag[2][:int(tag[1])]
-    logbook.append(qso)    
-  return logbook
-
-def sortlogbook(data):
-  for i in range(len(data)):
-    # convert all entries into lower case and ensure qso_date and time_on exists
-    data[i] = {k.lower(): v for k, v in data[i].items()}
-    if 'qso_date' not in data[i]:
-      data[i]['qso_date'] = ""
-    if 'time_on' not in data[i]:
-      data[i]['time_on'] = ""
-  return sorted(data, key = lambda x: x['qso_date'] + x['time_on'])
-
-def save(operator, fn, data):
-  fh=open(fn,'w')
-  fh.write('Log: %s\nGenerated by SA6MWA import.py\nhttps://github.com/sa6mwa/sa6mwa-logs\nbased on ADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n' % fn)
-  for qso in sortlogbook(data):
+import bisect
+import adif
+import adiftime
+import adiftrace
+
+FOLLOW_INTERVAL = 1.0
+
+def header(fn):
+  return 'Log: %s\nGenerated by SA6MWA import.py\nhttps://github.com/sa6mwa/sa6mwa-logs\nbased on ADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n' % fn
+
+def save(fn, data):
+  if adif.isadx(fn):
+    import adifadx
+    adifadx.save(fn, adif.merge([data]))
+    return
+  adif.save(fn, header(fn), adif.merge([data]))
+
+def append(fn, data):
+  # adds data to the end of fn (with a header if fn is new), leaving what is
+  # already in fn as it is
+  adif.append(fn, data, header(fn))
+
+def sorts_after(fn, qsos):
+  # True if fn is in time order and none of qsos sorts before its last QSO,
+  # then qsos (sorted) can be appended to fn and it stays in order. ADX logs
+  # are always saved in full.
+  if not os.path.exists(fn) or adif.isadx(fn):
+    return False
+  index = adiftime.update(fn)
+  keys = [adiftime.key(qso) for qso in qsos]
+  if not index["sorted"] or None in keys:
+    return False
+  return index["last"] is None or min(keys) >= index["last"]
+
+def logbook_index(logbook):
+  # set of match keys for O(1) duplicate lookups, see adif.matchkey()
+  return set(adif.matchkey(qso) for qso in logbook)
+
+def qso_not_in_logbook(qso, index):
+  # returns True if qso is not in index (from logbook_index())
+  if adiftrace.ENABLED:
+    adiftrace.add("dedup_comparisons")
+  return adif.matchkey(qso) not in index
+
+def time_index(logbook):
+  # {(call, mode, band): sorted timestamps} of logbook, for duplicate checks
+  # within a tolerance that can be added to as QSOs come in
+  index = dict()
+  for qso in logbook:
+    call, mode, band, ts = adif.matchkey(qso)
+    index.setdefault((call, mode, band), list()).append(adif.timestamp(qso))
+  for times in index.values():
+    times.sort()
+  return index
+
+def in_time_index(index, qso, tolerance):
+  # True if index has a QSO with the same call, mode and band as qso at most
+  # tolerance seconds from it
+  call, mode, band, ts = adif.matchkey(qso)
+  t = adif.timestamp(qso)
+  times = index.get((call, mode, band), ())
+  i = bisect.bisect_left(times, t - tolerance)
+  return i < len(times) and times[i] <= t + tolerance
+
+def add_time_index(index, qso):
+  call, mode, band, ts = adif.matchkey(qso)
+  bisect.insort(index.setdefault((call, mode, band), list()), adif.timestamp(qso))
+
+def importable(fn, qso):
+  # False (and says why) for a record of fn that cannot be imported: a field
+  # duplicates are matched on is missing or its date or time is not a number
+  try:
+    adif.matchkey(qso)
+    adif.timestamp(qso)
+  except (AssertionError, ValueError) as err:
+    print "Skipping a record of %s: %s" % (fn, err)
+    return False
+  return True
+
+def tail(fn, offset):
+  # the records appended to fn since byte offset, returns ([qso,...], offset
+  # after the last complete record). A record that is still being written is
+  # left for the next call. If fn has shrunk it was replaced, read it again.
+  qsos = list()
+  fh = open(fn, 'rb')
+  try:
+    if os.fstat(fh.fileno()).st_size < offset:
+      offset = 0
+    fh.seek(offset)
+    for tag, qso, first, last in adif.scan(fh, offset=offset):
+      if tag == "eor":
+        qsos.append(qso)
+      offset = last
+  finally:
+    fh.close()
+  return qsos, offset
+
+def follow(destinationlog, adifs, operator, tolerance, start, end, dryrun, worked=None):
+  # Imports the source logs and keeps importing what is appended to them until
+  # interrupted. Only the new bytes of each source are read, new QSOs are
+  # checked against an index of the destination kept in memory and appended
+  # to the destination (and added to the worked-before index worked, if
+  # given).
+  import time
+  prefix = "Will add" if dryrun else "Adding"
+  db = None
+  index = None
+  if adif.isdb(destinationlog):
+    import adifdb
+    db = adifdb.connect(destinationlog)
+  else:
+    index = time_index(adif.parse(destinationlog) if os.path.exists(destinationlog) else [])
+  offsets = dict((f, 0) for f in adifs)
+  sizes = dict((f, -1) for f in adifs)
+  print "Following %s, press Ctrl-C to stop." % ", ".join(adifs)
+  sys.stdout.flush()
+  try:
+    while True:
+      for f in adifs:
+        try:
+          size = os.path.getsize(f)
+        except OSError:
+          continue
+        if size == sizes[f]:
+          continue
+        sizes[f] = size
+        qsos, offsets[f] = tail(f, offsets[f])
+        qsos = [qso for qso in adiftime.between(qsos, start, end) if importable(f, qso)]
+        if db:
+          added = [qso for qso, isnew in adifdb.insert(db, withoperator(operator, qsos), tolerance) if isnew]
+          if dryrun:
+            db.rollback()
+          else:
+            db.commit()
+        else:
+          added = list()
+          for qso in qsos:
+            if not in_time_index(index, qso, tolerance or 0):
+              add_time_index(index, qso)
+              added.append(qso)
+          if added and not dryrun:
+            append(destinationlog, withoperator(operator, added))
+        if added and worked and not dryrun:
+          import adifworked
+          adifworked.update(worked, [destinationlog])
+        for qso in added:
+          print "{}: {}, {}, {}, {}, {}".format(prefix, qso["call"], qso["qso_date"], qso["time_on"], qso["mode"], qso["band"])
+        sys.stdout.flush()
+      time.sleep(FOLLOW_INTERVAL)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    if db:
+      db.close()
+
+def sources(adifs, start, end):
+  # the QSOs of the source logs (ADIF files or databases) in the date range
+  for f in adifs:
+    for qso in adiftrace.timed("sources", adiftime.iterlog(f, start, end)):
+      yield qso
+
+def withoperator(operator, qsos):
+  # sets operator on the QSOs that do not have one
+  for qso in qsos:
     if "operator" not in qso and operator:
       qso["operator"] = operator.upper()
-    for key in sorted(qso):
-      value = qso[key]
-      fh.write('<%s:%i>%s ' % (key.upper(), len(value), value))
-    fh.write('<EOR>\n')
-  fh.close()
-
-def conv_datetime(adi_date, adi_time):
-  return datetime.datetime.strptime(adi_date+adi_time.ljust(6,"0"), "%Y%m%d%H%M%S")
-
-def compareQSO(qso1, qso2):
-  match_keys = [ "call", "mode", "band" ]
-  qso1 = { k.lower(): v for k, v in qso1.items() }
-  qso2 = { k.lower(): v for k, v in qso2.items() }
-  match = True
-  for qso in [ qso1, qso2 ]:
-    assert "qso_date" in qso, "qso_date not in qso: {}".format(qso)
-    assert "time_on" in qso, "time_on not in qso: {}".format(qso)
-  for k in match_keys:
-    for qso in [ qso1, qso2 ]:
-      assert k in qso, "required key {} is not in qso: {}".format(k, qso)
-    qso1time = conv_datetime(qso1["qso_date"], qso1["time_on"])
-    qso2time = conv_datetime(qso2["qso_date"], qso2["time_on"])
-    if qso1time != qso2time:
-      match = False
-    if qso1[k] != qso2[k]:
-      match = False
-  return match
-
-def qso_not_in_logbook(qso, logbook, hours=0):
-  # returns True if qso is not in logbook or if hours > 0, return False (as if
-  # qso was in logbook) if qso is older than hours old
-  retval = True
-  if hours > 0:
-    for k in [ "qso_date", "time_on" ]:
-      assert k in qso, "required key {} is not in qso: {}".format(k, qso)
-    after = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
-    qsotime = conv_datetime(qso["qso_date"], qso["time_on"])
-    if qsotime < after:
-      return False
-  for lbqso in logbook:
-    if compareQSO(qso, lbqso):
-      retval = False
-  return retval
+    yield qso
 
 def usage():
   print """usage:
-{} -a destinationlog.adif [-c operator] [-l hours] [-n] sourcelog1.adif [sourcelog2.adif...]
+{} -a destinationlog.adif|destinationlog.db [-c operator] [-l hours] [-T seconds] [-W index] [-n] [-F] [-V] sourcelog1.adif [sourcelog2.adif...]
   -a, --logfile destinationlog  Log file to append QSOs to
   -c, --operator operator       Add or replace operator field with this value
   -l, --last hours              Only import QSOs dated within the last x hours
+      --from datetime           Only import QSOs from this date and time on,
+                                YYYYMMDD[HH[MM[SS]]] (separators are ignored)
+      --to datetime             Only import QSOs up to this date and time
+  -T, --tolerance seconds       Treat QSOs with the same call, band and mode
+                                at most this many seconds apart as
+                                duplicates (default is exact date and time)
+  -W, --worked index            Also add the imported QSOs to this
+                                worked-before index (see worked.py), only
+                                the QSOs appended are read
   -n, --dry-run                 Only show what would be imported, do not
                                 modify destination log
+  -V, --validate                Check the source logs first (see validate.py),
+                                print their problems and import nothing if
+                                there are any
+  -F, --follow                  Keep running and import QSOs as they are
+                                appended to the source logs (e.g. by WSJT-X
+                                or termlog), they are appended to the
+                                destination log as they come in, records
+                                that cannot be imported are skipped
+      --profile                 When done, print time per stage, record and
+                                byte counts, dedup comparisons and peak
+                                memory as JSON on stderr (or ADIF_TRACE=1)
+      --profile-dump file       Also write cProfile stats to file (or
+                                ADIF_TRACE_DUMP=file)
+  Logs named *.adx (or *.adx.gz etc) are ADX, an ADX destination is always
+  rewritten in full.
+  A destination (or source) log named *.db or *.sqlite is a SQLite logbook,
+  QSOs are added to it without rewriting it and duplicates are dropped by its
+  unique index on call, mode, band, date and time. Use lexa.py -e to export it.
 """.format(sys.argv[0]),
 def main():
   try:
-    opts, adifs = getopt.getopt(sys.argv[1:], "ha:c:nl:", ["help","logfile=","operator=","dry-run","last="])
+    opts, adifs = getopt.getopt(sys.argv[1:], "ha:c:nl:T:W:FV", ["help","logfile=","operator=","dry-run","validate","last=","tolerance=","worked=","from=","to=","follow","profile","profile-dump="])
   except getopt.GetoptError as err:
     print str(err)
     usage()
@@ -100,6 +218,12 @@ def main():
   operator = None
   dryrun = False
   hours = 0.0
+  tolerance = None
+  start = None
+  end = None
+  following = False
+  worked = None
+  validating = False
   for o, a in opts:
     if o in ("-h", "--help"):
       usage()
@@ -112,31 +236,120 @@ def main():
       dryrun = True
     elif o in ("-l", "--last"):
       hours = float(a)
+    elif o in ("-T", "--tolerance"):
+      tolerance = int(a)
+    elif o in ("-W", "--worked"):
+      worked = a
+    elif o in ("-F", "--follow"):
+      following = True
+    elif o in ("-V", "--validate"):
+      validating = True
+    elif o == "--profile":
+      adiftrace.enable()
+    elif o == "--profile-dump":
+      adiftrace.enable(a)
+    elif o == "--from":
+      start = adiftime.bound(a)
+    elif o == "--to":
+      end = adiftime.bound(a, upper=True)
     else:
       assert False, "unhandled option"
   if not destinationlog or len(adifs) < 1:
     usage()
     sys.exit(2)
-  logbook = list()
-  if os.path.exists(destinationlog):
-    if not os.path.isfile(destinationlog):
-      print "error: %s is not a file!" % destinationlog
+  if validating:
+    import validate
+    if validate.report(adifs):
+      print "error: not importing, fix the problems above first"
       sys.exit(1)
-    logbook = parse(destinationlog)
-  logbook_original_length = len(logbook)
-  for f in adifs:
-    flogbook = parse(f)
-    for qso in flogbook:
-      if qso_not_in_logbook(qso, logbook, hours):
-        prefix = "Adding"
-        if dryrun:
-          prefix = "Will add"
+  if hours > 0:
+    import datetime
+    after = (datetime.datetime.utcnow() - datetime.timedelta(hours=hours)).strftime("%Y%m%d%H%M%S")
+    start = max(start, after) if start else after
+  if following:
+    if [f for f in adifs if adif.isdb(f) or adif.compression(f) or adif.isadx(f)]:
+      print "error: only uncompressed ADIF logs can be followed"
+      sys.exit(2)
+    if adif.isadx(destinationlog):
+      print "error: --follow appends to the destination, which ADX logs cannot be"
+      sys.exit(2)
+    follow(destinationlog, adifs, operator, tolerance, start, end, dryrun, worked)
+    return
+  prefix = "Adding"
+  if dryrun:
+    prefix = "Will add"
+  if adif.isdb(destinationlog):
+    # the database drops the duplicates itself, all QSOs go in as one
+    # transaction which a dry run rolls back
+    import adifdb
+    db = adifdb.connect(destinationlog)
+    added = 0
+    for qso, isnew in adiftrace.timed("insert", adifdb.insert(db, withoperator(operator, sources(adifs, start, end)), tolerance)):
+      if isnew:
         print "{}: {}, {}, {}, {}, {}".format(prefix, qso["call"], qso["qso_date"], qso["time_on"], qso["mode"], qso["band"])
-        logbook.append(qso)
-  if len(logbook) > 0 and len(logbook) > logbook_original_length:
+        added += 1
+    with adiftrace.stage("write"):
+      if dryrun:
+        db.rollback()
+      else:
+        db.commit()
+    db.close()
+    if not added:
+      print "Nothing to add to %s." % destinationlog
+    elif not dryrun:
+      print "Saved " + destinationlog
+      if worked:
+        import adifworked
+        adifworked.update(worked, [destinationlog])
+    return
+  ranged = start is not None or end is not None
+  logbook = list()
+  with adiftrace.stage("destination"):
+    if os.path.exists(destinationlog):
+      if not os.path.isfile(destinationlog):
+        print "error: %s is not a file!" % destinationlog
+        sys.exit(1)
+      if ranged:
+        # only QSOs within the range (widened by the tolerance) can be
+        # duplicates, in an ordered log the rest is not even read
+        margin = tolerance or 0
+        logbook = [adif.QSO(qso) for qso in adiftime.iterlog(destinationlog, adiftime.shift(start, -margin), adiftime.shift(end, margin))]
+      else:
+        logbook = adif.parse(destinationlog)
+  added = list()
+  with adiftrace.stage("dedup"):
+    if tolerance is None:
+      index = logbook_index(logbook)
+      for qso in sources(adifs, start, end):
+        if qso_not_in_logbook(qso, index):
+          print "{}: {}, {}, {}, {}, {}".format(prefix, qso["call"], qso["qso_date"], qso["time_on"], qso["mode"], qso["band"])
+          added.append(adif.QSO(qso))
+          index.add(adif.matchkey(qso))
+    else:
+      qsos = list(sources(adifs, start, end))
+      if adiftrace.ENABLED:
+        adiftrace.add("dedup_comparisons", len(qsos))
+      for qso, isnew in zip(qsos, adif.sweep(logbook, qsos, tolerance)):
+        if isnew:
+          print "{}: {}, {}, {}, {}, {}".format(prefix, qso["call"], qso["qso_date"], qso["time_on"], qso["mode"], qso["band"])
+          added.append(adif.QSO(qso))
+  if added:
     if not dryrun:
-      save(operator, destinationlog, logbook)
+      # the operator only goes on the imported QSOs, the destination log is
+      # left as it is whether it is appended to or saved in full
+      added = list(withoperator(operator, added))
+      with adiftrace.stage("write"):
+        if sorts_after(destinationlog, added):
+          # only the new QSOs are written
+          append(destinationlog, adif.merge([added]))
+        else:
+          if ranged and os.path.exists(destinationlog):
+            logbook = adif.parse(destinationlog)
+          save(destinationlog, logbook + added)
       print "Saved " + destinationlog
+      if worked:
+        import adifworked
+        adifworked.update(worked, [destinationlog])
   else:
     print "Nothing to add to %s." % destinationlog
 if __name__ == '__main__':
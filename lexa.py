@@ -3,11 +3,11 @@
 # DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
 # partly based on ADIF.PY by OK4BX http://web.bxhome.org
 import sys, errno, getopt, os
-import re
-import datetime
-import time
-
-ADIF_REC_RE = re.compile(r'<(.*?):(\d+).*?>([^<\t\f\v]+)')
+import itertools
+import bisect
+import adif
+import adiftime
+import adiftrace
 
 fieldtemplates = {
   "narrow":       { "template": "{:8s} {:8s} {:11s} {:6s} {:5s} {:10s} {:6s} {:8s} {:8s}",
@@ -19,79 +19,78 @@ fieldtemplates = {
 }
 default_fieldtemplate = "narrow"
 
-def parse(fn):
-  raw = re.split('<eor>|<eoh>(?i)', open(fn).read() )
-  logbook =[]
-  for record in raw[1:-1]:
-    qso = {}
-    tags = ADIF_REC_RE.findall(record)
-    for tag in tags:
-      qso[tag[0].lower()] = tag[2][:int(tag[1])]
-    logbook.append(qso)    
-  return logbook
+def exporters(exports, fields):
+  # one adifexport sink per -e output, all written in the same pass
+  import adifexport
+  header = "Log: {}\nGenerated by SA6MWA lexa.py\nhttps://github.com/sa6mwa/sa6mwa-logs\nbased on ADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n"
+  return [adifexport.sink(output, fields=fields, head=header) for output in exports]
+
+def indexranges(ranges):
+  # merges (first, last) index ranges into sorted, non overlapping ranges
+  merged = list()
+  for first, last in sorted(ranges):
+    if merged and first <= merged[-1][1] + 1:
+      merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+    else:
+      merged.append((first, last))
+  return merged
+
+def inranges(c, ranges, firsts):
+  # firsts is the list of the first index of each range in ranges
+  i = bisect.bisect_right(firsts, c) - 1
+  return i >= 0 and c <= ranges[i][1]
 
-def sortlogbook(data):
-  for i in range(len(data)):
-    # convert all entries into lower case and ensure qso_date and time_on exists
-    data[i] = {k.lower(): v for k, v in data[i].items()}
-    if 'qso_date' not in data[i]:
-      data[i]['qso_date'] = ""
-    if 'time_on' not in data[i]:
-      data[i]['time_on'] = ""
-  return sorted(data, key = lambda x: x['qso_date'] + x['time_on'])
+def edit(edits, qso, field, value):
+  qso[field] = value
+  edits.setdefault(id(qso), dict())[field] = value
 
-def save(fn, data):
-  header = "Log: {}\nGenerated by SA6MWA lexa.py\nhttps://github.com/sa6mwa/sa6mwa-logs\nbased on ADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n".format(fn)
-  if os.path.exists(fn):
-    split = re.split('<eoh>(?i)', open(fn).read())
-    if len(split) > 1:
-      header = split[0] + '<EOH>\n'
-  fh=open(fn,'w')
-  fh.write(header)
-  for qso in data:
-    for key in sorted(qso):
-      value = qso[key]
-      fh.write('<%s:%i>%s ' % (key.upper(), len(value), value))
-    fh.write('<EOR>\n')
-  fh.close()
+def window(fn, start, end, where):
+  # yields (qso, span) for the QSOs of fn in the date range, span is what
+  # save_edits() needs to find the QSO again: (fn, start, end) of the record in
+  # an ADIF file or (fn, id, None) of the row in a database
+  if adif.isdb(fn):
+    import adifdb
+    for qso, rowid in adifdb.window(fn, start, end, where):
+      yield qso, (fn, rowid, None)
+  elif adif.isadx(fn):
+    # listed only, main() refuses to edit ADX logs
+    for qso in adiftime.between(adif.iterparse(fn), start, end):
+      yield adif.QSO(qso), (fn, None, None)
+  else:
+    for qso, first, last in adiftime.window(fn, start, end):
+      yield adif.QSO(qso), (fn, first, last)
 
-def conv_datetime(adi_date, adi_time):
-  return datetime.datetime.strptime(adi_date+adi_time.ljust(6,"0"), "%Y%m%d%H%M%S")
+def inorder(fn, build):
+  # True if the QSOs of fn are read in time order, see adif.merge(): a
+  # database always is, an ADIF log if its time index says so (built first
+  # if build is True)
+  if adif.isdb(fn):
+    return True
+  if adif.isadx(fn):
+    return False
+  return adiftime.ordered(fn, build)
 
-def compareQSO(qso1, qso2):
-  match_keys = [ "call", "mode", "band" ]
-  qso1 = { k.lower(): v for k, v in qso1.items() }
-  qso2 = { k.lower(): v for k, v in qso2.items() }
-  match = True
-  for qso in [ qso1, qso2 ]:
-    assert "qso_date" in qso, "qso_date not in qso: {}".format(qso)
-    assert "time_on" in qso, "time_on not in qso: {}".format(qso)
-  for k in match_keys:
-    for qso in [ qso1, qso2 ]:
-      assert k in qso, "required key {} is not in qso: {}".format(k, qso)
-    qso1time = conv_datetime(qso1["qso_date"], qso1["time_on"])
-    qso2time = conv_datetime(qso2["qso_date"], qso2["time_on"])
-    if qso1time != qso2time:
-      match = False
-    if qso1[k] != qso2[k]:
-      match = False
-  return match
+def save_edits(spans, edits):
+  # patch only the edited records, leaving the rest of each file as it is. An
+  # edit that cannot be saved (e.g. one that would make a QSO in a database a
+  # duplicate) ends the program with an error.
+  try:
+    _save_edits(spans, edits)
+  except ValueError as err:
+    print "error: %s" % err
+    sys.exit(1)
 
-def qso_not_in_logbook(qso, logbook, hours=0):
-  # returns True if qso is not in logbook or if hours > 0, return False (as if
-  # qso was in logbook) if qso is older than hours old
-  retval = True
-  if hours > 0:
-    for k in [ "qso_date", "time_on" ]:
-      assert k in qso, "required key {} is not in qso: {}".format(k, qso)
-    after = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
-    qsotime = conv_datetime(qso["qso_date"], qso["time_on"])
-    if qsotime < after:
-      return False
-  for lbqso in logbook:
-    if compareQSO(qso, lbqso):
-      retval = False
-  return retval
+def _save_edits(spans, edits):
+  patches = dict()
+  for qsoid, changes in edits.items():
+    fn, start, end = spans[qsoid]
+    patches.setdefault(fn, list()).append((start, end, changes))
+  for fn in patches:
+    if adif.isdb(fn):
+      import adifdb
+      adifdb.update(fn, [(rowid, changes) for rowid, end, changes in patches[fn]])
+    else:
+      adif.patchfile(fn, patches[fn])
 
 def usage():
   print """usage: {prog} [options] logfile.adif [logfile.adif...]
@@ -99,7 +98,8 @@ def usage():
   -t, --template tmpl Use field template tmpl (default is "{deftmpl}").
                       Available field templates:
                       {tmpl}
-  -u, --unsorted      Do not sort logbook (by date and time)
+  -u, --unsorted      Do not sort QSOs by date and time across all files,
+                      list the files one after another
   -i, --index index   For use with -f, -v or -q options - specify that you
                       want to manipulate logbook index. index can be
                       integers or ranges x-y separated by commas
@@ -115,21 +115,56 @@ def usage():
                       field x of QSO with index specified with -i
   -v, --value y       For use with -i, set the value of field specified with
                       -f above to y of QSO with index given with -i
-  -e, --export o.adif Export complete output to adif file o.adif
-  -m, --per-minute    Calculate average QSOs per minute (and per hour)
+  -e, --export o.adif Export complete output to adif file o.adif. Can be
+                      given more than once, all files are written in the
+                      same pass. The format follows from the extension
+                      (.adi, .adif, .adx, .cbr, .csv, .jsonl) or is given
+                      as format:file with format adif, smff, adx, cabrillo,
+                      csv or jsonl. CSV has the columns of the field template
+  -m, --per-minute    After the QSOs, print average QSOs per minute and
+                      hour, the best 10 and 60 minute rates, the peak hour,
+                      on- and off-time (gaps of 30 minutes or more) and QSOs
+                      per band, mode and UTC hour (uses NumPy if installed)
+  -w, --where query   Only QSOs matching query, terms like band=20m,
+                      mode=CW|SSB, call~^SM, date>=20210101 or qsl_rcvd!=Y
+                      (ops are = != ~ !~ < <= > >=), all terms must match.
+                      Numbering (for -i) counts matching QSOs only
+  -L, --limit n       Stop after listing n QSOs. Only the QSOs listed are
+                      read if the logs are in time order (their time index,
+                      logfile.adif.tix, says so and is created for it) or
+                      with -u, otherwise all QSOs are read to sort them
+      --from datetime Only QSOs from this date and time on, given as
+                      YYYYMMDD[HH[MM[SS]]] (separators are ignored)
+      --to datetime   Only QSOs up to and including this date and time
+  -C, --cache         List from a columnar cache of each logfile (created as
+                      logfile.adif.idx and rebuilt when logfile changes),
+                      only used when not editing or exporting
+      --profile       When done, print the time spent reading, sorting and
+                      writing, record and byte counts and peak memory as
+                      JSON on stderr (also ADIF_TRACE=1 in the environment)
+      --profile-dump f Also write cProfile stats to file f (or set
+                      ADIF_TRACE_DUMP=f)
+  A logfile named *.db or *.sqlite is a SQLite logbook (see import.py), it is
+  listed, filtered and edited through its indexes and -e exports it as ADIF.
 EXAMPLES
   # Set TX_PWR field to 10 for QSOs number 34 and 35
   $ {prog} -i 34,35 -f tx_pwr -v 10 mylog1.adif mylog2.adif
+  # List 20m CW QSOs with Swedish stations not yet confirmed
+  $ {prog} -w "band=20m mode=CW call~^S[A-M]" -w qsl_rcvd!=Y mylog1.adif
   # Set QSL_RCVD to Y and QSL_SENT to Q for QSO number 2
   $ {prog} -i 2 -q rq mylog1.adif mylog2.adif
   # Filter out QSOs 1 to 10 and 34, then save as new.adif
   $ {prog} -i 1-10,34 -e new.adif file1.adif file2.adif
+  # List the QSOs of 12 February 2021
+  $ {prog} --from 2021-02-12 --to 2021-02-12 mylog1.adif
+  # Export the 2021 QSOs of a SQLite logbook as ADIF
+  $ {prog} --from 20210101 --to 20211231 -e 2021.adif mylog.db
 """.format(prog=sys.argv[0], deftmpl=default_fieldtemplate, tmpl=', '.join(fieldtemplates))
 
 
 def main():
   try:
-    opts, adifs = getopt.getopt(sys.argv[1:], "hnt:ui:Rq:f:v:e:m", ["help","dry-run","template=","unsorted","index=","reverse","qsl=","field=","value=","export=","per-minutes"])
+    opts, adifs = getopt.getopt(sys.argv[1:], "hnt:ui:Rq:f:v:e:mCw:L:", ["help","dry-run","template=","unsorted","index=","reverse","qsl=","field=","value=","export=","per-minutes","cache","from=","to=","where=","limit=","profile","profile-dump="])
   except getopt.GetoptError as err:
     print str(err)
     usage()
@@ -143,8 +178,13 @@ def main():
   qsl_sent = None
   field = None
   value = None
-  export = None
+  exports = list()
   perminute = False
+  cache = False
+  tfrom = None
+  tto = None
+  where = list()
+  limit = None
   for o, a in opts:
     if o in ("-h", "--help"):
       usage()
@@ -162,12 +202,9 @@ def main():
         for val in index:
           assert val.isdigit(), "-i must be one or more numbers or range separated by comma (,)"
         if len(index) == 1:
-          indices.append(int(index[0]))
+          indices.append((int(index[0]), int(index[0])))
         elif len(index) == 2:
-          start = int(index[0])
-          finish = int(index[1]) + 1
-          for x in range(start, finish):
-            indices.append(int(x))
+          indices.append((int(index[0]), int(index[1])))
         else:
           usage()
           assert False, "wrong format of option -i"
@@ -187,79 +224,154 @@ def main():
     elif o in ("-v", "--value"):
       value = a
     elif o in ("-e", "--export"):
-      export = a
+      exports.append(a)
     elif o in ("-m", "--per-minutes"):
       perminute = True
+    elif o in ("-C", "--cache"):
+      cache = True
+    elif o in ("-w", "--where"):
+      where.append(a)
+    elif o in ("-L", "--limit"):
+      limit = int(a)
+      assert limit > 0, "-L must be at least 1"
+    elif o == "--from":
+      tfrom = adiftime.bound(a)
+    elif o == "--to":
+      tto = adiftime.bound(a, upper=True)
+    elif o == "--profile":
+      adiftrace.enable()
+    elif o == "--profile-dump":
+      adiftrace.enable(a)
     else:
       assert False, "unhandled option"
   if len(adifs) < 1:
     usage()
     sys.exit(2)
+  indices = indexranges(indices)
+  firsts = [first for first, last in indices]
+  if indices and (qsl_rcvd or qsl_sent or (field and value)) and [f for f in adifs if adif.isadx(f)]:
+    print "error: ADX logs cannot be edited, export them to ADIF with -e first"
+    sys.exit(2)
 
 
   tmpl = "{:<4s} " + fieldtemplates[fieldtemplate]["template"]
+  try:
+    sinks = exporters(exports, fieldtemplates[fieldtemplate]["fields"])
+  except ValueError as err:
+    print "error: %s" % err
+    sys.exit(2)
   hdrf = [x.upper() for x in [ "# id" ] + fieldtemplates[fieldtemplate]["fields"]]
   print tmpl.format(*hdrf)
 
-  modified_logbook = False
+  edits = dict()
   na = "N/A"
   c = 1
-  exportlogbook = list()
-  start_time = None
-  end_time = None
   qsos_printed = 0
+  stats = None
+  if perminute:
+    import adifstats
+    stats = adifstats.Stats()
 
-  for fn in adifs:
-    logbook = parse(fn)
-    if sort:
-      logbook = sortlogbook(logbook)
-    for qso in logbook:
-      printqso = True
-      if indices:
-        printqso = False
-        match = c in indices if not reverse else c not in indices
-        if match:
-          printqso = True
-          if qsl_rcvd:
-            qso["qsl_rcvd"] = qsl_rcvd
-            modified_logbook = True
-          if qsl_sent:
-            qso["qsl_sent"] = qsl_sent
-            modified_logbook = True
-          if field and value:
-            qso[field] = value
-            modified_logbook = True
-      if printqso:
-        if export:
-          exportlogbook.append(qso)
-        try:
-          fields = [ str(c) ]
-          for f in fieldtemplates[fieldtemplate]["fields"]:
-            fields.append(qso[f] if f in qso else na)
-          print tmpl.format(*fields)
-          qsos_printed += 1
-          if perminute and "qso_date" in qso and "time_on" in qso:
-            end_time = conv_datetime(qso["qso_date"], qso["time_on"])
-            if not start_time:
-              start_time = end_time
-        except IOError as e:
-          if e.errno == errno.EPIPE:
-            if modified_logbook and not dryrun:
-              save(fn, logbook)
-            sys.exit(0)
-      c += 1
-
+  pred = None
+  if where:
+    import adifquery
+    pred = adifquery.predicate(where)
+  # nothing after the last index or the limit is listed, stop reading there
+  lastindex = indices[-1][1] if indices and not reverse else None
+  spans = dict()
+  # logs listed from their sidecar cache, which reads them in time order
+  cached = [False] * len(adifs)
+  if indices:
+    # QSOs may be modified, remember where each QSO is so that only the
+    # modified records have to be rewritten
+    streams = list()
+    for fn in adifs:
+      logbook = list()
+      for qso, span in adiftrace.timed("read", window(fn, tfrom, tto, where)):
+        spans[id(qso)] = span
+        logbook.append(qso)
+      streams.append(logbook)
+  elif cache and not exports:
+    # only read the printed fields (and the sort key) from the sidecar
+    import adifcache
+    fields = fieldtemplates[fieldtemplate]["fields"] + [ "qso_date", "time_on" ]
+    if pred:
+      fields += pred.fields
     if perminute:
-      ts = time.mktime(start_time.timetuple())
-      te = time.mktime(end_time.timetuple())
-      per_minute = qsos_printed / (float(te-ts) / 60.0)
-      per_hour = qsos_printed / (float(te-ts) / 60.0 / 60.0)
-      print "# QSOs per minute = {:0.2f}, QSOs per hour = {:0.2f}".format(per_minute, per_hour)
+      fields += [ "band", "mode" ]
+    cached = [not adif.isdb(fn) and not adif.isadx(fn) for fn in adifs]
+    streams = [adiftime.between(adifcache.records(fn, fields, sort), tfrom, tto) if listed else adiftime.iterlog(fn, tfrom, tto, where) for fn, listed in zip(adifs, cached)]
+  else:
+    streams = [adiftime.iterlog(fn, tfrom, tto, where) for fn in adifs]
+  if not indices:
+    streams = [adiftrace.timed("read", s) for s in streams]
+  if pred:
+    # filter before merging so that -i numbers the matching QSOs
+    streams = [itertools.ifilter(pred, s) for s in streams]
+  if sort:
+    # one time ordered listing across all files, only spill to disk when the
+    # QSOs are not already in memory. Logs known to be in order are merged as
+    # they are read, worth indexing a log for if the listing stops early.
+    ordered = [listed or inorder(fn, lastindex is not None or limit is not None) for fn, listed in zip(adifs, cached)]
+    qsos = adiftrace.timed("sort", adif.merge(streams, None if indices else adif.SORT_BUDGET, ordered))
+  else:
+    qsos = itertools.chain(*streams)
+
+  for qso in qsos:
+    printqso = True
+    if indices:
+      printqso = False
+      match = inranges(c, indices, firsts) != reverse
+      if match:
+        printqso = True
+        if qsl_rcvd:
+          edit(edits, qso, "qsl_rcvd", qsl_rcvd)
+        if qsl_sent:
+          edit(edits, qso, "qsl_sent", qsl_sent)
+        if field and value:
+          edit(edits, qso, field, value)
+    if printqso:
+      try:
+        for sink in sinks:
+          sink.add(qso)
+      except ValueError as err:
+        # e.g. a QSO without the fields SMFF needs, no file is written
+        for sink in sinks:
+          sink.abort()
+        print "error: %s" % err
+        sys.exit(1)
+      try:
+        fields = [ str(c) ]
+        for f in fieldtemplates[fieldtemplate]["fields"]:
+          fields.append(qso[f] if f in qso else na)
+        print tmpl.format(*fields)
+        qsos_printed += 1
+        if stats is not None:
+          stats.add(qso)
+      except IOError as e:
+        if e.errno == errno.EPIPE:
+          for sink in sinks:
+            sink.abort()
+          if not dryrun:
+            save_edits(spans, edits)
+          sys.exit(0)
+    c += 1
+    # stop before the next QSO is read
+    if (lastindex is not None and c > lastindex) or (limit is not None and qsos_printed >= limit):
+      break
+
+  if stats is not None:
+    with adiftrace.stage("stats"):
+      for line in stats.report():
+        print line
 
-    if modified_logbook and not dryrun:
-      save(fn, logbook)
-    if export:
-      save(export, exportlogbook)
+  with adiftrace.stage("write"):
+    if not dryrun:
+      save_edits(spans, edits)
+    for sink in sinks:
+      sink.close()
+  if adiftrace.ENABLED:
+    adiftrace.add("printed", qsos_printed)
 
 if __name__ == '__main__':
   main()
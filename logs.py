@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# logs.py - one entry point for the sa6mwa-logs scripts
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+#   logs.py list [options] logfile.adif...      same as lexa.py
+#   logs.py import [options] source.adif...     same as import.py
+#   logs.py aggregate [options]                 same as adifaggregator.py
+#   logs.py set-fields [options] logfile.adif   same as add_fields.py
+#   logs.py smff [options] source.adif...       same as termlog2smff-activator.py
+#   logs.py worked [options] call...            same as worked.py
+#   logs.py validate [options] logfile.adif...   same as validate.py
+#
+# Only the script of the given command (and the adif modules it uses) is
+# imported, so a command starts about as fast as running its script directly.
+# The scripts share adif.py and friends and still work on their own.
+import sys
+
+COMMANDS = [
+  ("list", "lexa", "list, edit and export QSOs"),
+  ("import", "import", "import/update ADIF logs into a single log"),
+  ("aggregate", "adifaggregator", "merge all logs in the current directory into one"),
+  ("set-fields", "add_fields", "set OPERATOR, STATION_CALLSIGN, TX_PWR, DISTANCE"),
+  ("smff", "termlog2smff-activator", "convert termlog ADIF logs to SMFF"),
+  ("worked", "worked", "look up calls in the worked-before index"),
+  ("validate", "validate", "check logs for bad records") ]
+
+def usage():
+  print "usage: %s command [options] [logfile...]" % sys.argv[0]
+  print
+  for name, module, description in COMMANDS:
+    print "  %-12s %s" % (name, description)
+  print
+  print "%s command -h shows the options of a command." % sys.argv[0]
+
+def main():
+  if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+    usage()
+    sys.exit(0 if len(sys.argv) > 1 else 2)
+  name = sys.argv[1]
+  modules = dict((c, m) for c, m, description in COMMANDS)
+  if name not in modules:
+    print "unknown command: %s" % name
+    usage()
+    sys.exit(2)
+  # the command's usage() shows "logs.py list" etc as the program name
+  sys.argv = ["%s %s" % (sys.argv[0], name)] + sys.argv[2:]
+  __import__(modules[name]).main()
+
+if __name__ == '__main__':
+  main()
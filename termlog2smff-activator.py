@@ -15,83 +15,16 @@
 # 73 DE SA6MWA
 # based on ADIF.PY by OK4BX http://web.bxhome.org
 import sys, getopt, os
-import re
-import datetime
-import time
-import glob
-ADIF_REC_RE = re.compile(r'<(.*?):(\d+).*?>([^<\t\f\v]+)')
-
-def parse(fn):
-  raw = re.split('<eor>|<eoh>(?i)', open(fn).read() )
-  logbook =[]
-  for record in raw[1:-1]:
-    qso = {}
-    tags = ADIF_REC_RE.findall(record)
-    for tag in tags:
-      qso[tag[0].lower()] = tag[2][:int(tag[1])]
-    logbook.append(qso)    
-  return logbook
-
-def sortlogbook(data):
-  for i in range(len(data)):
-    # convert all entries into lower case and ensure qso_date and time_on exists
-    data[i] = {k.lower(): v for k, v in data[i].items()}
-    if 'qso_date' not in data[i]:
-      data[i]['qso_date'] = ""
-    if 'time_on' not in data[i]:
-      data[i]['time_on'] = ""
-  return sorted(data, key = lambda x: x['qso_date'] + x['time_on'])
-
-def savesmff(operator, fn, data):
-  required_keys = [
-    "call", "qso_date", "time_on",
-    "rst_sent", "rst_rcvd", "mode",
-    "band", "stx_string" ]
-  smff_keys = [
-    "operator",
-    "call",
-    "qso_date",
-    "time_on",
-    "rst_sent",
-    "rst_rcvd",
-    "mode",
-    "band",
-    "my_city",
-    "qth",
-    "notes" ]
-  fh=open(fn,'w')
-  fh.write('Log: %s\nGenerated by SA6MWA termlog2smff-activator.py\nhttps://github.com/sa6mwa\nbased on ADIF.PY by OK4BX\nhttp://web.bxhome.org\n<EOH>\n\n' % fn)
-  for qso in sortlogbook(data):
-    # sortlogbook() returns all keys in lower case
-    for k in required_keys:
-      if k not in qso:
-        print "error: %s key is not in the following qso:\n%s" % (k, qso)
-        sys.exit(1)
-    qso["my_city"] = qso.pop("stx_string", "")
-    qso["qth"] = qso.pop("srx_string", "")
-    if "operator" not in qso:
-      qso["operator"] = operator.upper()
-    else:
-      qso["operator"] = qso["operator"].upper()
-    for key in smff_keys:
-      if key not in qso:
-        # 1st for loop above has already confirmed that the required keys are
-        # in the qso
-        qso[key] = ""
-      value = qso[key]
-      fh.write("<%s:%i>%s\n" % (key.upper(), len(value), value))
-    fh.write("<EOR>\n\n")
-  fh.close()
-
-#def conv_datetime(adi_date, adi_time):
-#    return datetime.datetime.strptime(adi_date+adi_time.ljust(6,"0"), "%Y%m%d%H%M%S")
+import adif
+import adifexport
+import adiftrace
 
 def usage():
-  print "usage: %s -o output-smff-log.adi [-c operator] [-s smffcode] sourcelog1.adif [sourcelog2.adif]" % sys.argv[0]
+  print "usage: %s -o output-smff-log.adi [-c operator] [-s smffcode] [--profile] [--profile-dump file] sourcelog1.adif [sourcelog2.adif]" % sys.argv[0]
 
 def main():
   try:
-    opts, adifs = getopt.getopt(sys.argv[1:], "ho:c:s:", ["help", "output=", "operator=", "smff-area="])
+    opts, adifs = getopt.getopt(sys.argv[1:], "ho:c:s:", ["help", "output=", "operator=", "smff-area=", "profile", "profile-dump="])
   except getopt.GetoptError as err:
     print str(err)
     usage()
@@ -109,6 +42,10 @@ def main():
       operator = a.upper()
     elif o in ("-s", "--smff-area"):
       smffarea = a.upper()
+    elif o == "--profile":
+      adiftrace.enable()
+    elif o == "--profile-dump":
+      adiftrace.enable(a)
     else:
       assert False, "unhandled option"
   if destinationlog is None or len(adifs) < 1:
@@ -119,8 +56,7 @@ def main():
     print "error: %s already exists, please choose another file name or move file!" % destinationlog
     sys.exit(1)
   for f in adifs:
-    flogbook = parse(f)
-    for qso in flogbook:
+    for qso in adiftrace.timed("read", adif.iterparse(f)):
       qso = { k.lower(): v for k, v in qso.items() }
       if not operator and "operator" not in qso:
         print "error: -c or --operator not set and operator key is missing in qso:\n%s" % qso
@@ -130,9 +66,14 @@ def main():
         sys.exit(1)
       if "stx_string" not in qso and smffarea:
         qso["stx_string"] = smffarea.upper()
-      logbook.append(qso)
+      logbook.append(adif.QSO(qso))
   if len(logbook) > 0:
-    savesmff(operator, destinationlog, logbook)
+    try:
+      with adiftrace.stage("write"):
+        adifexport.export(adif.merge([logbook]), [adifexport.SmffSink(destinationlog, operator=operator)])
+    except ValueError as err:
+      print "error: %s" % err
+      sys.exit(1)
     print "Saved " + destinationlog
   else:
     print "Will not create empty log %s." % destinationlog
@@ -0,0 +1,46 @@
+# tests for adifcache.py, run with python -m unittest discover tests
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+import adifcache
+from test_import import record, write
+
+class FallbackTest(unittest.TestCase):
+  # records() parses the log when the sidecar cannot answer
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.fn = os.path.join(self.dir, "log.adif")
+    write(self.fn, [record("SM2AAA", "20200102", "1200"), record("SM1AAA", "20200101", "1200")])
+
+  def tearDown(self):
+    adifcache.MAXSIZE = 0xFFFFFFFF
+    shutil.rmtree(self.dir)
+
+  def calls(self, names, ordered=False):
+    return [qso["call"] for qso in adifcache.records(self.fn, names, ordered)]
+
+  def test_cached(self):
+    self.assertEqual(self.calls(["call"]), ["SM2AAA", "SM1AAA"])
+    self.assertEqual(self.calls(["call"], True), ["SM1AAA", "SM2AAA"])
+
+  def test_no_cached_column(self):
+    # none of the fields is in the sidecar, every QSO is still listed
+    self.assertEqual([qso.get("freq") for qso in adifcache.records(self.fn, ["freq"])], [None, None])
+    self.assertEqual(self.calls(["freq"], True), ["SM1AAA", "SM2AAA"])
+
+  def test_too_large(self):
+    adifcache.MAXSIZE = 10
+    self.assertRaises(IOError, adifcache.build, self.fn)
+    self.assertEqual(self.calls(["call"], True), ["SM1AAA", "SM2AAA"])
+    self.assertFalse(os.path.exists(adifcache.cachename(self.fn)))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,37 @@
+# tests for adiftime.py, run with python -m unittest discover tests
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+import adiftime
+
+class WindowTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.fn = os.path.join(self.dir, "sg6fo.adif")
+    shutil.copy(os.path.join(ROOT, "sg6fo.adif"), self.fn)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def calls(self):
+    return [qso["call"] for qso, first, last in adiftime.window(self.fn, "20180504230000", "20180504235959")]
+
+  def test_unsaved_index(self):
+    # the index cannot be written (as in a read-only directory), the whole
+    # log is read instead
+    os.mkdir(adiftime.indexname(self.fn) + ".tmp")
+    self.assertEqual(self.calls(), ["UG3G", "UN7QE", "UA3QTD", "2E0RLR"])
+    self.assertFalse(os.path.exists(adiftime.indexname(self.fn)))
+    os.rmdir(adiftime.indexname(self.fn) + ".tmp")
+    self.assertEqual(self.calls(), ["UG3G", "UN7QE", "UA3QTD", "2E0RLR"])
+    self.assertTrue(os.path.exists(adiftime.indexname(self.fn)))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,61 @@
+# tests for adifadx.py, run with python -m unittest discover tests
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+import adif
+import adifadx
+
+# reads an ADX log and prints the peak RSS in kB after the first tenth of the
+# records and at the end, in a process of its own so that nothing else
+# counts towards the peak
+PEAK = """
+import sys, resource
+sys.path.insert(0, %r)
+import adifadx
+n = int(sys.argv[2])
+for i, qso in enumerate(adifadx.iterparse(sys.argv[1]), 1):
+  if i == n // 10:
+    first = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print first, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, i
+""" % ROOT
+
+def qsos(n):
+  for i in xrange(n):
+    yield {"call": "SM%dABC" % (i % 10), "qso_date": "20200101", "time_on": "%06d" % (i % 240000), "band": "20m", "mode": "FT8", "app_wsjtx_snr": "-12"}
+
+class AdxTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_roundtrip(self):
+    fn = os.path.join(self.dir, "log.adx")
+    records = list(qsos(3)) + [{"call": "SM6XYZ", "comment": "a <b> & \xc3\xa5"}]
+    adifadx.save(fn, records)
+    self.assertEqual(list(adif.iterparse(fn)), records)
+
+  def test_flat_memory(self):
+    # the records read must not be kept, reading ten times as many records
+    # must not need more memory
+    n = 200000
+    fn = os.path.join(self.dir, "large.adx")
+    adifadx.save(fn, qsos(n))
+    p = subprocess.Popen([sys.executable, "-c", PEAK, fn, str(n)], stdout=subprocess.PIPE)
+    first, last, count = map(int, p.communicate()[0].split())
+    self.assertEqual(count, n)
+    # ru_maxrss is in kB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    self.assertLess((last - first) * scale, 1 << 20)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,61 @@
+# tests for adifaggregator.py, run with python -m unittest discover tests
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+import adif
+import adiftime
+import adifaggregator
+from test_import import record, write
+
+class ToleranceTest(unittest.TestCase):
+  # an incremental run with -T drops the QSOs close in time to one in
+  # all.adif and keeps the others
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    write(os.path.join(self.dir, "a.adif"), [record("SM%dAAA" % i, "2020010%d" % i, "1200") for i in range(1, 6)])
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def aggregate(self):
+    p = subprocess.Popen([sys.executable, os.path.join(ROOT, "adifaggregator.py"), "-T", "60"], cwd=self.dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = p.communicate()[0]
+    self.assertEqual(p.returncode, 0, out)
+    return out
+
+  def calls(self):
+    return sorted(qso["call"] for qso in adif.iterparse(os.path.join(self.dir, "all.adif")))
+
+  def test_incremental(self):
+    self.assertIn("Saved all.adif", self.aggregate())
+    write(os.path.join(self.dir, "b.adif"), [
+      record("SM2AAA", "20200102", "120030"), # a duplicate of a.adif
+      record("SM4AAA", "20200104", "1210"), # ten minutes later
+      record("SM9AAA", "20200109", "1200"),
+      record("SM9AAA", "20200109", "120045")]) # a duplicate within b.adif
+    self.assertIn("Added 2 QSOs to all.adif", self.aggregate())
+    self.assertEqual(self.calls(), ["SM1AAA", "SM2AAA", "SM3AAA", "SM4AAA", "SM4AAA", "SM5AAA", "SM9AAA"])
+
+  def test_nearby(self):
+    # with a window per QSO only the QSOs around them are read
+    self.aggregate()
+    step = adiftime.STEP
+    adiftime.STEP = 1
+    try:
+      qsos = [dict(call="SM9AAA", qso_date="20200102", time_on="120030"), dict(call="SM9AAA", qso_date="20200104", time_on="1159")]
+      found = adifaggregator.nearby(os.path.join(self.dir, "all.adif"), qsos, 60)
+      self.assertEqual([qso["call"] for qso in found], ["SM2AAA", "SM4AAA"])
+    finally:
+      adiftime.STEP = step
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,106 @@
+# tests for import.py, run with python -m unittest discover tests
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import subprocess
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+import adif
+
+def record(call, date, time, **fields):
+  qso = dict(call=call, qso_date=date, time_on=time, mode="CW", band="20m")
+  qso.update(fields)
+  return adif.record(qso)
+
+def write(fn, records):
+  fh = open(fn, "wb")
+  fh.write("<EOH>\n" + "".join(records))
+  fh.close()
+
+def run(script, *args):
+  # runs script with args, returns (exit status, output)
+  p = subprocess.Popen([sys.executable, os.path.join(ROOT, script)] + list(args), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  out = p.communicate()[0]
+  return p.returncode, out
+
+class OperatorTest(unittest.TestCase):
+  # -c stamps only the imported QSOs, whether they are appended to the
+  # destination or it is saved in full
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.dest = os.path.join(self.dir, "dest.adif")
+    write(self.dest, [record("SM%dAAA" % i, "2020010%d" % i, "1200") for i in range(1, 4)])
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def operators(self):
+    return dict((qso["call"], qso.get("operator")) for qso in adif.iterparse(self.dest))
+
+  def check(self, source):
+    fn = os.path.join(self.dir, "source.adif")
+    write(fn, source)
+    status, out = run("import.py", "-c", "sa6mwa", "-a", self.dest, fn)
+    self.assertEqual(status, 0, out)
+    return self.operators()
+
+  def test_in_order(self):
+    ops = self.check([record("SM4AAA", "20200104", "1200"), record("SM5AAA", "20200105", "1200")])
+    self.assertEqual(ops, {"SM1AAA": None, "SM2AAA": None, "SM3AAA": None, "SM4AAA": "SA6MWA", "SM5AAA": "SA6MWA"})
+
+  def test_out_of_order(self):
+    ops = self.check([record("SM4AAA", "20200104", "1200"), record("SM0AAA", "20191231", "1200")])
+    self.assertEqual(ops, {"SM1AAA": None, "SM2AAA": None, "SM3AAA": None, "SM4AAA": "SA6MWA", "SM0AAA": "SA6MWA"})
+
+  def test_same_on_both_paths(self):
+    # an operator already in a QSO is kept
+    ops = self.check([record("SM4AAA", "20200104", "1200", operator="SM6XYZ")])
+    self.assertEqual(ops["SM4AAA"], "SM6XYZ")
+    self.assertEqual(ops["SM1AAA"], None)
+
+class FollowTest(unittest.TestCase):
+  # -F skips a record it cannot import and goes on following
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.dest = os.path.join(self.dir, "dest.adif")
+    self.source = os.path.join(self.dir, "source.adif")
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def calls(self, n):
+    # the calls of dest once it has n QSOs (or what it has after 20 seconds)
+    for i in range(200):
+      if os.path.exists(self.dest):
+        calls = [qso["call"] for qso in adif.iterparse(self.dest)]
+        if len(calls) >= n:
+          return calls
+      time.sleep(0.1)
+    return calls
+
+  def test_malformed(self):
+    write(self.source, ["<call:6>SM1BAD<qso_date:8>20200101<eor>\n", record("SM1AAA", "20200101", "1200")])
+    p = subprocess.Popen([sys.executable, os.path.join(ROOT, "import.py"), "-F", "-a", self.dest, self.source], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+      self.assertEqual(self.calls(1), ["SM1AAA"])
+      fh = open(self.source, "ab")
+      fh.write(record("SM2BBB", "20200102", "1200x") + record("SM2AAA", "20200102", "1200"))
+      fh.close()
+      self.assertEqual(self.calls(2), ["SM1AAA", "SM2AAA"])
+    finally:
+      p.send_signal(signal.SIGINT)
+      out = p.communicate()[0]
+    self.assertEqual(p.returncode, 0, out)
+    self.assertIn("Skipping a record of %s: required key time_on" % self.source, out)
+    self.assertIn("Skipping a record of %s: invalid literal" % self.source, out)
+
+if __name__ == '__main__':
+  unittest.main()
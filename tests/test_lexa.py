@@ -0,0 +1,41 @@
+# tests for lexa.py, run with python -m unittest discover tests
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+from test_import import record, write, run
+
+class LimitTest(unittest.TestCase):
+  # -L stops reading at the last QSO listed, not one record later
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.fn = os.path.join(self.dir, "log.adif")
+    write(self.fn, [record("SM%dAAA" % i, "2020010%d" % i, "1200") for i in range(1, 6)])
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def listing(self, *args):
+    # (listed calls, records read) of lexa.py --profile with args
+    status, out = run("lexa.py", "--profile", *(args + (self.fn,)))
+    self.assertEqual(status, 0, out)
+    lines = out.splitlines()
+    calls = [line.split()[3] for line in lines[1:-1]]
+    return calls, json.loads(lines[-1])["stages"]["read"]["records"]
+
+  def test_limit(self):
+    self.assertEqual(self.listing("-L", "2"), (["SM1AAA", "SM2AAA"], 2))
+
+  def test_unsorted(self):
+    self.assertEqual(self.listing("-u", "-L", "3"), (["SM1AAA", "SM2AAA", "SM3AAA"], 3))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,58 @@
+# tests for validate.py and import.py -V, run with python -m unittest discover tests
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+import adifvalidate
+from test_import import record, write, run
+
+class FreqTest(unittest.TestCase):
+
+  def problems(self, freq, band="20m"):
+    return adifvalidate.problems(dict(call="SM6XYZ", qso_date="20200101", time_on="1200", mode="CW", band=band, freq=freq))
+
+  def test_mhz(self):
+    self.assertEqual(self.problems("14.035"), [])
+
+  def test_khz(self):
+    # termlog writes kHz
+    self.assertEqual(self.problems("14035.86"), [])
+
+  def test_wrong_band(self):
+    self.assertEqual(self.problems("7.035"), ["freq 7.035 is in 40m, not band 20m"])
+    self.assertEqual(self.problems("7035"), ["freq 7035 is in 40m, not band 20m"])
+    self.assertEqual(self.problems("99"), ["freq 99 is outside of all bands, not band 20m"])
+
+class GateTest(unittest.TestCase):
+  # import.py -V lets the logs termlog writes through
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_termlog(self):
+    status, out = run("validate.py", os.path.join(ROOT, "termlog.adif"))
+    self.assertEqual((status, out), (0, ""))
+    source = os.path.join(self.dir, "termlog.adif")
+    shutil.copy(os.path.join(ROOT, "termlog.adif"), source)
+    status, out = run("import.py", "-V", "-a", os.path.join(self.dir, "dest.adif"), source)
+    self.assertEqual(status, 0, out)
+    self.assertTrue("Saved" in out, out)
+
+  def test_bad_log(self):
+    source = os.path.join(self.dir, "bad.adif")
+    write(source, [record("SM6XYZ", "20201301", "1200")])
+    status, out = run("import.py", "-V", "-a", os.path.join(self.dir, "dest.adif"), source)
+    self.assertEqual(status, 1, out)
+    self.assertFalse(os.path.exists(os.path.join(self.dir, "dest.adif")))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# validate.py - report the bad records of ADIF logs
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# Checks every record of the logs with adifvalidate.py and prints one line
+# per problem as logfile:line: message, exits with 1 if there were any. Meant
+# to be run before importing, see also import.py -V.
+import sys, getopt
+import adif
+import adifvalidate
+
+def usage():
+  print """usage:
+{} [-s] [-c operator] logfile.adif [logfile.adif...]
+  -s, --smff                    Also require the fields SMFF needs (see
+                                termlog2smff-activator.py)
+  -c, --operator operator       With -s, the operator is given, QSOs need no
+                                OPERATOR field
+  Checks dates, times, band against freq, required fields and declared
+  lengths, e.g. <call:4>SM6XYZ. Problems in ADX logs and SQLite logbooks are
+  reported by record number. Exits with 1 if a problem was found.""".format(sys.argv[0])
+
+def smff(operator=None):
+  # the fields termlog2smff-activator.py needs
+  import adifexport
+  required = list(adifvalidate.REQUIRED)
+  for k in adifexport.SmffSink.REQUIRED + ([] if operator else ["operator"]):
+    if k not in required:
+      required.append(k)
+  return required
+
+def report(fns, required=adifvalidate.REQUIRED):
+  # prints the problems of the logs fns, returns the number found
+  count = 0
+  for fn in fns:
+    where = "%s: record %d" if adif.isdb(fn) or adif.isadx(fn) else "%s:%d"
+    for line, msg in adifvalidate.check(fn, required):
+      print "%s: %s" % (where % (fn, line), msg)
+      count += 1
+  return count
+
+def main():
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "hsc:", ["help","smff","operator="])
+  except getopt.GetoptError as err:
+    print str(err)
+    usage()
+    sys.exit(2)
+  smffing = False
+  operator = None
+  for o, a in opts:
+    if o in ("-h", "--help"):
+      usage()
+      sys.exit()
+    elif o in ("-s", "--smff"):
+      smffing = True
+    elif o in ("-c", "--operator"):
+      operator = a
+    else:
+      assert False, "unhandled option"
+  if len(args) < 1:
+    usage()
+    sys.exit(2)
+  required = smff(operator) if smffing else adifvalidate.REQUIRED
+  if report(args, required):
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# worked.py - has a call been worked before (on this band and mode)?
+# DE SA6MWA https://github.com/sa6mwa/sa6mwa-logs
+#
+# Looks calls up in the worked-before index of adifworked.py, build it once
+# with worked.py -U *.adif and keep it up to date with import.py -W.
+import sys, getopt, os
+import adifworked
+
+def usage():
+  print """usage:
+{0} [-W index] -U logfile.adif [logfile.adif...]
+{0} [-W index] [-b band] [-M mode] call [call...]
+  -W, --worked index Worked-before index (default is $ADIF_WORKED or {1})
+  -U, --update       Add the QSOs of the logs to the index (only what has
+                     been appended since the last update is read)
+  -b, --band band    Only QSOs on this band
+  -M, --mode mode    Only QSOs in this mode
+  A call ending in * lists all calls starting with it, e.g. SM6*, other *
+  and ? patterns (*/P, SM?ABC) are matched against all calls. Exits with 1 if
+  none of the calls have been worked (on band and mode).""".format(sys.argv[0], adifworked.DEFAULT)
+
+def main():
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], "hW:Ub:M:", ["help","worked=","update","band=","mode="])
+  except getopt.GetoptError as err:
+    print str(err)
+    usage()
+    sys.exit(2)
+  fn = os.environ.get("ADIF_WORKED") or adifworked.DEFAULT
+  updating = False
+  band = None
+  mode = None
+  for o, a in opts:
+    if o in ("-h", "--help"):
+      usage()
+      sys.exit()
+    elif o in ("-W", "--worked"):
+      fn = a
+    elif o in ("-U", "--update"):
+      updating = True
+    elif o in ("-b", "--band"):
+      band = a
+    elif o in ("-M", "--mode"):
+      mode = a
+    else:
+      assert False, "unhandled option"
+  if len(args) < 1:
+    usage()
+    sys.exit(2)
+  if updating:
+    index = adifworked.update(fn, args)
+    print "%s: %i calls from %i logs" % (fn, len(index["calls"]), len(index["logs"]))
+    return
+  index = adifworked.load(fn)
+  worked = False
+  for pattern in args:
+    found = False
+    for call in adifworked.calls(index, pattern):
+      for b, m, dxcc, first, last, count in adifworked.lookup(index, call, band, mode):
+        print "{:11s} {:5s} {:6s} dxcc {:4s} {:8s}-{:8s} {:d} QSO{}".format(call, b or "N/A", m or "N/A", dxcc or "N/A", first[:8], last[:8], count, "" if count == 1 else "s")
+        found = True
+    if not found:
+      print "{:11s} not worked{}".format(pattern.upper(), " on " + " ".join(x for x in (band, mode) if x) if band or mode else "")
+    worked = worked or found
+  if not worked:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()